@@ -76,6 +76,21 @@ def argument_parser() -> argparse.ArgumentParser:
         "--no-web", action="store_false", help="Disable web interface", dest="web"
     )
     parser.add_argument("--port", type=int, help="Port for web interface", dest="port")
+    parser.add_argument(
+        "--replicate",
+        action="store_true",
+        help="Stream database changes to a standby",
+        dest="replicate",
+    )
+    parser.add_argument(
+        "--standby",
+        metavar="SOCKET",
+        help=(
+            "Follow the database of the primary on this socket, SIGUSR1 promotes."
+            " Must run from another directory than the primary"
+        ),
+        dest="standby",
+    )
 
     return parser.parse_args()
 
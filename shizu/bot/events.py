@@ -66,7 +66,7 @@ from typing import Union, List, Any, Optional
 
 from .. import utils, logger as lo
 from .types import Item
-from .. import database
+from .. import database, metrics, permissions
 
 logger = logging.getLogger(__name__)
 
@@ -212,18 +212,17 @@ class Events(Item):
             if not await self._check_filters(func, func.__self__, message):
                 continue
             try:
-                await func(self._app, message)
+                with metrics.registry.measure(
+                    "message", metrics.owner(func), func.__name__
+                ):
+                    await func(self._app, message)
             except Exception as error:
                 logging.exception(error)
         return message
 
     async def _inline_handler(self, inline_query: InlineQuery) -> InlineQuery:
         """Handles inline queries"""
-        if inline_query.from_user.id != database.db.get(
-            "shizu.me", "me"
-        ) and inline_query.from_user.id not in database.db.get(
-            "shizu.me", "owners", []
-        ):
+        if not permissions.perms.is_allowed(inline_query.from_user.id):
             return await inline_query.answer(
                 [
                     InlineQueryResultArticle(
@@ -276,13 +275,14 @@ class Events(Item):
         args = " ".join(query_[1:])
 
         if func := self._all_modules.inline_handlers.get(cmd):
-            if (
-                len(vars_ := inspect.getfullargspec(func).args) > 3
-                and vars_[3] == "args"
-            ):
-                await func(self._app, inline_query, args)
-            else:
-                await func(self._app, inline_query)
+            with metrics.registry.measure("inline", metrics.owner(func), cmd):
+                if (
+                    len(vars_ := inspect.getfullargspec(func).args) > 3
+                    and vars_[3] == "args"
+                ):
+                    await func(self._app, inline_query, args)
+                else:
+                    await func(self._app, inline_query)
 
         try:
             if self._forms[query].get("type", None) == "form":
@@ -402,10 +402,9 @@ class Events(Item):
                         "_switch_query" in button
                         and "input" in button
                         and button["_switch_query"] == query.split()[0]
-                        and inline_query.from_user.id
-                        in [self._me]
-                        + form["always_allow"]
-                        + self._db.get("shizu.me", "owners", []) + [self._me]
+                        and permissions.perms.is_allowed(
+                            inline_query.from_user.id, form["always_allow"]
+                        )
                     ):
                         await inline_query.answer(
                             [
@@ -549,7 +548,10 @@ class Events(Item):
 
             for query_func in mod.callback_handlers.values():
                 try:
-                    await query_func(query)
+                    with metrics.registry.measure(
+                        "callback", metrics.owner(query_func), query_func.__name__
+                    ):
+                        await query_func(query)
                 except Exception:
                     logger.exception("Error on running callback watcher!")
                     await query.answer(
@@ -567,11 +569,8 @@ class Events(Item):
                 if button.get("_callback_data", None) == query.data:
                     if (
                         form["force_me"]
-                        and query.from_user.id != self._me
-                        and (
-                            query.from_user.id
-                            not in form["always_allow"]
-                            + self._db.get("shizu.me", "owners", [] + [self._me])
+                        and not permissions.perms.is_allowed(
+                            query.from_user.id, form["always_allow"]
                         )
                     ):
                         await query.answer(
@@ -589,12 +588,19 @@ class Events(Item):
 
                     query.form = {"id": form_uid, **form}
 
+                    callback = button["_callback"]
+
                     try:
-                        return await button["_callback"](
-                            query,
-                            *button.get("args", []),
-                            **button.get("kwargs", {}),
-                        )
+                        with metrics.registry.measure(
+                            "callback",
+                            metrics.owner(callback),
+                            getattr(callback, "__name__", "button"),
+                        ):
+                            return await callback(
+                                query,
+                                *button.get("args", []),
+                                **button.get("kwargs", {}),
+                            )
                     except Exception:
                         logger.exception("Error on running callback watcher!")
                         await query.answer(
@@ -610,8 +616,7 @@ class Events(Item):
         if query.data in self._custom_map:
             if (
                 self._custom_map[query.data].get("force_me", None)
-                and query.from_user.id != self._me
-                and query.from_user.id not in self._db.get("shizu.me", "owners", []) + [self._me] 
+                and not permissions.perms.is_allowed(query.from_user.id)
             ):
                 await query.answer("🚫 You are not allowed to press this button!")
                 return
@@ -631,10 +636,9 @@ class Events(Item):
                     "_switch_query" in button
                     and "input" in button
                     and button["_switch_query"] == query.split()[0]
-                    and chosen_inline_query.from_user.id
-                    in [self._me]
-                    + form["always_allow"]
-                    + self._db.get("shizu.me", "owners", []) + [self._me]
+                    and permissions.perms.is_allowed(
+                        chosen_inline_query.from_user.id, form["always_allow"]
+                    )
                 ):
                     query = query.split(maxsplit=1)[1] if len(query.split()) > 1 else ""
 
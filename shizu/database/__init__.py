@@ -1,6 +1,47 @@
-__all__ = ['Database']
+__all__ = [
+    'Database',
+    'Transaction',
+    'Backend',
+    'JSONBackend',
+    'JournalBackend',
+    'ShardedJSONBackend',
+    'SQLiteBackend',
+]
 
-from .frontend import Database
+import os
 
+from . import codecs
+from .backends import (
+    Backend,
+    JSONBackend,
+    JournalBackend,
+    ShardedJSONBackend,
+    SQLiteBackend,
+    migrate_json,
+)
+from .frontend import Database, Transaction
 
-db = Database("./db.json")
+JSON_LOCATION = "./db.json"
+SQLITE_LOCATION = "./db.sqlite3"
+JOURNAL_LOCATION = "./db.journal"
+SHARDS_LOCATION = "./db.shards"
+ARCHIVE_LOCATION = "./db.archive"
+
+mode = os.environ.get("SHIZU_DB", "").lower()
+codec = codecs.get(os.environ.get("SHIZU_DB_CODEC"))
+sharded = os.environ.get("SHIZU_DB_SHARDS", "").lower() in (
+    "1",
+    "true",
+) or os.path.isdir(SHARDS_LOCATION)
+
+if mode == "sqlite" or os.path.exists(SQLITE_LOCATION):
+    if not os.path.exists(SQLITE_LOCATION) and os.path.exists(JSON_LOCATION):
+        migrate_json(JSON_LOCATION, SQLITE_LOCATION)
+
+    db = Database(SQLITE_LOCATION, backend=SQLiteBackend(SQLITE_LOCATION, sharded))
+elif mode == "journal" or os.path.exists(JOURNAL_LOCATION):
+    db = Database(JSON_LOCATION, backend=JournalBackend(JSON_LOCATION, codec))
+elif sharded:
+    db = Database(JSON_LOCATION, backend=ShardedJSONBackend(JSON_LOCATION, codec))
+else:
+    db = Database(JSON_LOCATION, backend=JSONBackend(JSON_LOCATION, codec))
@@ -0,0 +1,596 @@
+import copy
+import hashlib
+import json
+import logging
+import marshal
+import os
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote
+
+from . import codecs
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, str]
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+CORE_PREFIX = "shizu."
+BLOB_KEY = "__blob__"
+
+
+class Backend:
+    """Storage engine of the database
+
+    The data is copied with `snapshot` on the loop, then `encode` and
+    `write` run in an executor while the loop keeps mutating the database.
+    A synchronous save calls `encode` with the database itself"""
+
+    def __init__(self, location: str) -> None:
+        self.location = Path(location)
+        self.unloaded: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        """Returns the database, except the namespaces left in `unloaded`"""
+        raise NotImplementedError
+
+    def load_namespace(self, name: str) -> Dict[str, Any]:
+        """Returns one of the `unloaded` namespaces"""
+        if name not in self.unloaded:
+            raise KeyError(name)
+
+        namespace = self.read_namespace(name)
+        self.unloaded.discard(name)
+
+        return namespace
+
+    def read_namespace(self, name: str) -> Dict[str, Any]:
+        """Reads a namespace from the disk, leaving it in `unloaded`"""
+        raise KeyError(name)
+
+    def scope(self, keys: Optional[Set[Key]]) -> Optional[Set[Key]]:
+        """Keys the next write covers, None to rewrite everything"""
+        return keys
+
+    def snapshot(
+        self, data: Dict[str, Any], keys: Optional[Set[Key]]
+    ) -> Dict[str, Any]:
+        """Copies the part of `data` that `encode` reads for these `keys`"""
+        if keys is None:
+            return copy_data(dict(data))
+
+        result = {}
+
+        for name, key in keys:
+            namespace = dict.get(data, name)
+
+            if not isinstance(namespace, dict):
+                continue
+
+            # Kept even without the key, a missing namespace was dropped
+            values = result.setdefault(name, {})
+
+            if key in namespace:
+                values[key] = namespace[key]
+
+        return copy_data(result)
+
+    def encode(self, data: Dict[str, Any], keys: Optional[Set[Key]]) -> Any:
+        """Serializes changed `keys` of `data`, everything if `keys` is None"""
+        raise NotImplementedError
+
+    def write(self, payload: Any) -> None:
+        """Persists the result of `encode`"""
+        raise NotImplementedError
+
+    def compact(self) -> None:
+        """Reclaims the space left by removed data"""
+
+    def close(self) -> None:
+        """Releases the resources of the engine"""
+
+
+class JSONBackend(Backend):
+    """Whole database in one file, LightDB compatible with the JSON codec
+
+    Files are read with whatever codec they were written with, so the
+    codec can be switched at any time"""
+
+    def __init__(self, location: str, codec: Optional[codecs.Codec] = None) -> None:
+        super().__init__(location)
+        self.codec = codec or codecs.JSON
+
+    def load(self) -> Dict[str, Any]:
+        if not self.location.exists():
+            return {}
+
+        return codecs.loads(self.location.read_bytes())
+
+    def snapshot(
+        self, data: Dict[str, Any], keys: Optional[Set[Key]]
+    ) -> Dict[str, Any]:
+        return copy_data(dict(data))
+
+    def encode(self, data: Dict[str, Any], keys: Optional[Set[Key]]) -> bytes:
+        return self.codec.dumps(dict(data))
+
+    def write(self, payload: bytes) -> None:
+        with self._lock:
+            atomic_write(self.location, payload)
+
+
+class ShardedJSONBackend(JSONBackend):
+    """Core namespaces in one JSON file and every module namespace in its own
+
+    Module namespaces are only read on first access. Values whose JSON is
+    bigger than `blob_threshold` bytes are kept out of line in a
+    content-addressed blob store, so they are not rewritten with the
+    rest of their namespace"""
+
+    def __init__(
+        self,
+        location: str,
+        codec: Optional[codecs.Codec] = None,
+        shards: Optional[str] = None,
+        blob_threshold: int = 64 * 1024,
+    ) -> None:
+        super().__init__(location, codec)
+        self.shards = Path(shards) if shards else self.location.with_suffix(".shards")
+        self.blobs = self.shards / "_blobs"
+        self.blob_threshold = blob_threshold
+        self._migrate = False
+
+    def load(self) -> Dict[str, Any]:
+        data = super().load()
+        on_disk = set(self._shard_names())
+
+        for name in list(data):
+            if is_shard(name):
+                # Left from the single file layout, moved on the next save
+                self._migrate = True
+
+                if name in on_disk:
+                    del data[name]
+
+        self.unloaded = on_disk - set(data)
+        return data
+
+    def read_namespace(self, name: str) -> Dict[str, Any]:
+        namespace = codecs.loads(self._shard(name).read_bytes())
+        return {key: self._load_blob(value) for key, value in namespace.items()}
+
+    def scope(self, keys: Optional[Set[Key]]) -> Optional[Set[Key]]:
+        return None if self._migrate else keys
+
+    def snapshot(
+        self, data: Dict[str, Any], keys: Optional[Set[Key]]
+    ) -> Dict[str, Any]:
+        if keys is None:
+            return copy_data(dict(data))
+
+        names = {name for name, _ in keys}
+
+        if not all(map(is_shard, names)):
+            names.update(name for name in data.keys() if not is_shard(name))
+
+        return copy_data(
+            {name: data[name] for name in names if dict.__contains__(data, name)}
+        )
+
+    def encode(self, data: Dict[str, Any], keys: Optional[Set[Key]]) -> tuple:
+        full = keys is None
+        names = set(data.keys()) if full else {name for name, _ in keys}
+
+        core = None
+        if full or not all(map(is_shard, names)):
+            core = self.codec.dumps(
+                {name: value for name, value in data.items() if not is_shard(name)}
+            )
+
+        shards, blobs = {}, {}
+
+        for name in filter(is_shard, names):
+            namespace = dict.get(data, name)
+            shards[name] = (
+                None if namespace is None else self._encode_shard(namespace, blobs)
+            )
+
+        keep = {name for name in data.keys() if is_shard(name)} | self.unloaded
+        return full, core, shards, blobs, keep
+
+    def write(self, payload: tuple) -> None:
+        full, core, shards, blobs, keep = payload
+
+        with self._lock:
+            self.blobs.mkdir(parents=True, exist_ok=True)
+
+            for digest, value in blobs.items():
+                if not (path := self.blobs / f"{digest}.json").exists():
+                    atomic_write(path, value)
+
+            for name, encoded in shards.items():
+                if encoded is None:
+                    self._shard(name).unlink(missing_ok=True)
+                else:
+                    atomic_write(self._shard(name), encoded)
+
+            if full:
+                for name in set(self._shard_names()) - keep:
+                    self._shard(name).unlink(missing_ok=True)
+
+            if core is not None:
+                atomic_write(self.location, core)
+
+            if full:
+                self._migrate = False
+
+    def compact(self) -> None:
+        self.prune_blobs()
+
+    def prune_blobs(self) -> int:
+        """Removes blobs no shard refers to, returns their number"""
+        with self._lock:
+            referenced = set()
+
+            for name in self._shard_names():
+                namespace = codecs.loads(self._shard(name).read_bytes())
+                referenced.update(
+                    value[BLOB_KEY] for value in namespace.values() if is_blob(value)
+                )
+
+            removed = 0
+
+            for path in self.blobs.glob("*.json"):
+                if path.stem not in referenced:
+                    path.unlink()
+                    removed += 1
+
+        return removed
+
+    def _shard(self, name: str) -> Path:
+        return self.shards / f"{quote(name, safe='')}.json"
+
+    def _shard_names(self) -> List[str]:
+        if not self.shards.exists():
+            return []
+
+        return [unquote(path.stem) for path in self.shards.glob("*.json")]
+
+    def _encode_shard(
+        self, namespace: Dict[str, Any], blobs: Dict[str, bytes]
+    ) -> bytes:
+        result = {}
+
+        for key, value in namespace.items():
+            if len(encoded := self.codec.dumps(value)) > self.blob_threshold:
+                digest = hashlib.sha256(encoded).hexdigest()
+                blobs[digest] = encoded
+                value = {BLOB_KEY: digest}
+
+            result[str(key)] = value
+
+        return self.codec.dumps(result)
+
+    def _load_blob(self, value: Any) -> Any:
+        if not is_blob(value):
+            return value
+
+        return codecs.loads((self.blobs / f"{value[BLOB_KEY]}.json").read_bytes())
+
+
+class JournalBackend(JSONBackend):
+    """JSON snapshot plus an append-only journal of changed keys
+
+    The journal starts with a header naming the snapshot it applies to,
+    so a journal left over from an interrupted compaction is ignored.
+    Records set or pop one key, or drop a whole namespace"""
+
+    def __init__(
+        self,
+        location: str,
+        codec: Optional[codecs.Codec] = None,
+        max_journal_size: int = 1024 * 1024,
+        compact_interval: int = 60 * 60,
+    ) -> None:
+        super().__init__(location, codec)
+        self.journal = self.location.with_suffix(".journal")
+        self.max_journal_size = max_journal_size
+        self.compact_interval = compact_interval
+        self._compacted_at: Optional[float] = None
+
+    def load(self) -> Dict[str, Any]:
+        data = super().load()
+        self._compacted_at = None
+
+        if not self.journal.exists():
+            return data
+
+        with self.journal.open("r", encoding="utf-8") as file:
+            lines = file.read().splitlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return data
+
+        if header.get("snapshot") != self._snapshot_id():
+            logger.warning("Ignoring journal of an older snapshot")
+            return data
+
+        self._compacted_at = header.get("time", 0)
+
+        for number, line in enumerate(lines[1:], start=2):
+            try:
+                namespace, key, op, value = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping broken journal record at line %s", number)
+                self._compacted_at = None
+                continue
+
+            if op == "set":
+                data.setdefault(namespace, {})[key] = value
+            elif op == "drop":
+                data.pop(namespace, None)
+            elif isinstance(data.get(namespace), dict):
+                data[namespace].pop(key, None)
+
+        return data
+
+    def scope(self, keys: Optional[Set[Key]]) -> Optional[Set[Key]]:
+        return None if self._should_compact() else keys
+
+    def snapshot(
+        self, data: Dict[str, Any], keys: Optional[Set[Key]]
+    ) -> Dict[str, Any]:
+        return Backend.snapshot(self, data, keys)
+
+    def encode(
+        self, data: Dict[str, Any], keys: Optional[Set[Key]]
+    ) -> Tuple[bool, Any]:
+        if keys is None:
+            return True, super().encode(data, None)
+
+        records, dropped = [], set()
+
+        for namespace, key in keys:
+            if namespace not in data:
+                if namespace not in dropped:
+                    dropped.add(namespace)
+                    records.append(_dumps([namespace, None, "drop", None]) + "\n")
+
+                continue
+
+            try:
+                record = [namespace, str(key), "set", data[namespace][key]]
+            except (KeyError, TypeError):
+                record = [namespace, str(key), "pop", None]
+
+            records.append(_dumps(record) + "\n")
+
+        return False, "".join(records)
+
+    def write(self, payload: Tuple[bool, Any]) -> None:
+        compact, data = payload
+
+        with self._lock:
+            if compact:
+                atomic_write(self.location, data)
+                header = {"snapshot": self._snapshot_id(), "time": time.time()}
+                atomic_write(self.journal, (_dumps(header) + "\n").encode("utf-8"))
+                self._compacted_at = header["time"]
+                return
+
+            with self.journal.open("a", encoding="utf-8") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _snapshot_id(self) -> Optional[List[int]]:
+        try:
+            stat = self.location.stat()
+        except FileNotFoundError:
+            return None
+
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _should_compact(self) -> bool:
+        if self._compacted_at is None:
+            return True
+
+        try:
+            size = self.journal.stat().st_size
+        except OSError:
+            return True
+
+        return (
+            size >= self.max_journal_size
+            or time.time() - self._compacted_at >= self.compact_interval
+        )
+
+
+class SQLiteBackend(Backend):
+    """SQLite database in WAL mode with one row per namespace and key"""
+
+    def __init__(self, location: str, lazy: bool = False) -> None:
+        super().__init__(location)
+        self.lazy = lazy
+        self._conn = sqlite3.connect(
+            self.location,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "namespace TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+
+    def load(self) -> Dict[str, Any]:
+        data = {}
+        query = "SELECT namespace, key, value FROM kv"
+
+        with self._lock:
+            if self.lazy:
+                query += f" WHERE namespace GLOB '{CORE_PREFIX}*'"
+                self.unloaded = {
+                    namespace
+                    for namespace, in self._conn.execute(
+                        "SELECT DISTINCT namespace FROM kv"
+                    )
+                    if is_shard(namespace)
+                }
+
+            for namespace, key, value in self._conn.execute(query):
+                data.setdefault(namespace, {})[key] = json.loads(value)
+
+        return data
+
+    def read_namespace(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                key: json.loads(value)
+                for key, value in self._conn.execute(
+                    "SELECT key, value FROM kv WHERE namespace = ?", (name,)
+                )
+            }
+
+    def encode(
+        self, data: Dict[str, Any], keys: Optional[Set[Key]]
+    ) -> Tuple[bool, List[Tuple[str, str, Optional[str]]], Set[str]]:
+        if keys is None:
+            return (
+                True,
+                [
+                    (namespace, str(key), _dumps(value))
+                    for namespace, values in data.items()
+                    if isinstance(values, dict)
+                    for key, value in values.items()
+                ],
+                set(self.unloaded),
+            )
+
+        rows = []
+
+        for namespace, key in keys:
+            try:
+                value = _dumps(data[namespace][key])
+            except (KeyError, TypeError):
+                value = None
+
+            rows.append((namespace, str(key), value))
+
+        return False, rows, set()
+
+    def write(
+        self, payload: Tuple[bool, List[Tuple[str, str, Optional[str]]], Set[str]]
+    ) -> None:
+        full, rows, keep = payload
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+
+            try:
+                if full:
+                    self._conn.executemany(
+                        "DELETE FROM kv WHERE namespace = ?",
+                        [
+                            (namespace,)
+                            for namespace, in self._conn.execute(
+                                "SELECT DISTINCT namespace FROM kv"
+                            ).fetchall()
+                            if namespace not in keep
+                        ],
+                    )
+
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                    [row for row in rows if row[2] is not None],
+                )
+                self._conn.executemany(
+                    "DELETE FROM kv WHERE namespace = ? AND key = ?",
+                    [row[:2] for row in rows if row[2] is None],
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            self._conn.execute("COMMIT")
+
+    def compact(self) -> None:
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def is_shard(name: str) -> bool:
+    """Whether the namespace belongs to a module rather than to the core"""
+    return not name.startswith(CORE_PREFIX)
+
+
+def is_blob(value: Any) -> bool:
+    """Whether the value is a reference to the blob store"""
+    return isinstance(value, dict) and list(value) == [BLOB_KEY]
+
+
+def copy_data(value: Any) -> Any:
+    """Deep copy of JSON-like data, to be read while the original changes
+
+    A marshal round trip copies it several times faster than deepcopy"""
+    try:
+        return marshal.loads(marshal.dumps(value))
+    except ValueError:
+        return copy.deepcopy(value)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Replaces the file so that readers never see a half-written one"""
+    temp = f"{path}.tmp"
+
+    with open(temp, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp, path)
+
+
+def from_location(location: str) -> Backend:
+    """Picks the storage engine by the file extension"""
+    if str(location).endswith(SQLITE_SUFFIXES):
+        return SQLiteBackend(location)
+
+    return JSONBackend(location)
+
+
+def migrate_json(source: str, target: str) -> int:
+    """Copies a LightDB JSON file into a new SQLite database
+
+    Returns the number of migrated keys"""
+    data = JSONBackend(source).load()
+    backend = SQLiteBackend(target)
+
+    try:
+        payload = backend.encode(data, None)
+        backend.write(payload)
+    finally:
+        backend.close()
+
+    logger.info("Migrated %s keys from %s to %s", len(payload[1]), source, target)
+    return len(payload[1])
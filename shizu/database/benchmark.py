@@ -0,0 +1,88 @@
+"""Compares the database codecs on a synthetic database
+
+Usage:
+    python -m shizu.database.benchmark [size in MB] [rounds]
+"""
+
+import random
+import string
+import sys
+import time
+
+from typing import Any, Callable, Dict
+
+from . import codecs
+
+
+def synthetic(size: int, seed: int = 0) -> Dict[str, Any]:
+    """Builds a database of roughly `size` bytes of JSON, shaped like a real one"""
+    rnd = random.Random(seed)
+
+    def text(length: int) -> str:
+        return "".join(rnd.choices(string.ascii_letters + " ", k=length))
+
+    data = {
+        "shizu.me": {"me": 123456789, "owners": list(range(10)), "lang": "en"},
+        "shizu.loader": {"prefixes": ["."], "aliases": {}, "modules": []},
+    }
+    total = 0
+
+    while total < size:
+        namespace = data.setdefault(f"Module{len(data)}", {})
+
+        for number in range(rnd.randint(5, 50)):
+            kind = rnd.random()
+
+            if kind < 0.4:
+                value = text(rnd.randint(5, 200))
+            elif kind < 0.6:
+                value = rnd.randint(-(2**40), 2**40)
+            elif kind < 0.8:
+                value = [rnd.randint(0, 2**32) for _ in range(rnd.randint(1, 100))]
+            else:
+                value = {
+                    text(8): {"id": rnd.randint(0, 2**32), "text": text(50)}
+                    for _ in range(rnd.randint(1, 20))
+                }
+
+            namespace[f"key{number}"] = value
+            total += len(codecs.JSON.dumps(value))
+
+    return data
+
+
+def measure(func: Callable[[], Any], rounds: int) -> float:
+    """Best wall time of `rounds` calls in milliseconds"""
+    best = float("inf")
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def main(size_mb: float = 10, rounds: int = 5) -> None:
+    data = synthetic(int(size_mb * 1024 * 1024))
+
+    print(f"{'codec':<10}{'size, KiB':>12}{'encode, ms':>14}{'decode, ms':>14}")
+
+    for codec in codecs.CODECS.values():
+        if not codec.available:
+            print(f"{codec.name:<10}{'not installed':>40}")
+            continue
+
+        encoded = codec.dumps(data)
+        assert codecs.loads(encoded) == data
+
+        print(
+            f"{codec.name:<10}"
+            f"{len(encoded) / 1024:>12.0f}"
+            f"{measure(lambda: codec.dumps(data), rounds):>14.1f}"
+            f"{measure(lambda: codecs.loads(encoded), rounds):>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*(float(arg) for arg in sys.argv[1:2]), *(int(arg) for arg in sys.argv[2:3]))
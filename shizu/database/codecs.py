@@ -0,0 +1,111 @@
+import json
+import marshal
+
+from typing import Any, Dict, Optional
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """Serialization format of the database files
+
+    Binary codecs start their output with a `header` byte that can not
+    begin a JSON document, so the format of a file is detected on load"""
+
+    name: str = None
+    header: bytes = b""
+    extension: str = None
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+    @property
+    def available(self) -> bool:
+        return True
+
+
+class JSONCodec(Codec):
+    """Plain JSON, readable by LightDB and by humans"""
+
+    name = "json"
+    extension = "json"
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class MarshalCodec(Codec):
+    """Python's own binary format, the fastest one without dependencies
+
+    Only meant for files written by Shizu itself"""
+
+    name = "marshal"
+    header = b"\x01"
+    extension = "marshal"
+
+    def dumps(self, data: Any) -> bytes:
+        return self.header + marshal.dumps(data, 4)
+
+    def loads(self, data: bytes) -> Any:
+        return marshal.loads(data[1:])
+
+
+class MsgpackCodec(Codec):
+    """MessagePack, needs the `msgpack` package"""
+
+    name = "msgpack"
+    header = b"\x02"
+    extension = "msgpack"
+
+    def dumps(self, data: Any) -> bytes:
+        return self.header + msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+
+    @property
+    def available(self) -> bool:
+        return msgpack is not None
+
+
+JSON = JSONCodec()
+
+CODECS: Dict[str, Codec] = {
+    codec.name: codec for codec in (JSON, MarshalCodec(), MsgpackCodec())
+}
+
+
+def get(name: Optional[str] = None) -> Codec:
+    """Returns the codec by its name, JSON by default"""
+    codec = CODECS.get((name or JSON.name).lower())
+
+    if codec is None:
+        raise ValueError(f"Unknown database codec: {name}")
+
+    if not codec.available:
+        raise ValueError(f"Database codec {name} is not installed")
+
+    return codec
+
+
+def detect(data: bytes) -> Codec:
+    """Returns the codec the data was written with"""
+    for codec in CODECS.values():
+        if codec.header and data[:1] == codec.header:
+            return get(codec.name)
+
+    return JSON
+
+
+def loads(data: bytes) -> Any:
+    """Decodes data written with any of the codecs"""
+    return detect(data).loads(data)
@@ -1,34 +1,794 @@
+import asyncio
+import atexit
+import contextvars
+import copy
+import logging
+import threading
+import time
+
 from lightdb import LightDB
 
-from typing import KT, VT
+from typing import (
+    KT,
+    VT,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+)
+
+from .backends import Backend, Key, from_location
+from .index import Index
+
+logger = logging.getLogger(__name__)
+
+WRITE_DELAY = 1.0
+
+EXPIRE_NAMESPACE = "shizu.expire"
+SWEEP_INTERVAL = 60
+SWEEP_BATCH = 500
+
+MISSING = object()
+
+Callback = Callable[[str, KT, VT], Any]
+
+
+def _copy(value: Any) -> Any:
+    return value if value is MISSING else copy.deepcopy(value)
+
+
+def _matches(value: Any, condition: Any) -> bool:
+    if value is MISSING:
+        return False
+
+    if isinstance(condition, slice):
+        try:
+            return (condition.start is None or value >= condition.start) and (
+                condition.stop is None or value < condition.stop
+            )
+        except TypeError:
+            return False
+
+    return value == condition
+
+
+class Transaction:
+    """Groups changes of the database into one commit
+
+    Changes made with `set`, `pop`, `reset` and through `setdefault` are
+    persisted and announced to subscribers once the outermost block
+    exits, or rolled back if it exits with an exception. Only the task
+    that opened the transaction takes part in it"""
+
+    def __init__(self, db: "Database") -> None:
+        self._db = db
+        self._outer: Optional["Transaction"] = None
+        self._token = None
+
+        self._keys: Dict[Key, Any] = {}
+        self._namespaces: Dict[str, Any] = {}
+        self._touched: Set[Key] = set()
+        self._full = False
+        self._reset = False
+
+    def __enter__(self) -> "Transaction":
+        self._outer = self._db._transaction.get()
+
+        if self._outer is None:
+            self._token = self._db._transaction.set(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> bool:
+        if self._outer is not None:
+            return False
+
+        self._db._transaction.reset(self._token)
+
+        if exc_type is None:
+            self._commit()
+        else:
+            self._rollback()
+
+        return False
+
+    async def __aenter__(self) -> "Transaction":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, tb) -> bool:
+        return self.__exit__(exc_type, exc_value, tb)
+
+    def _remember_key(self, name: str, key: KT) -> None:
+        # An unread namespace looks empty, and a rollback to that would
+        # remove the key from the disk
+        self._db._ensure_loaded(name)
+
+        if name not in self._db:
+            self._remember_namespace(name)
+
+        if (name, key) not in self._keys:
+            namespace = dict.get(self._db, name, {})
+            self._keys[(name, key)] = _copy(namespace.get(key, MISSING))
+
+    def _remember_namespace(self, name: str) -> None:
+        self._db._ensure_loaded(name)
+
+        if name not in self._namespaces:
+            self._namespaces[name] = _copy(dict.get(self._db, name, MISSING))
+
+    def _commit(self) -> None:
+        # Keys changed through a namespace bypassed `_touch`, their indexes
+        # were not told about it
+        changed = set()
+
+        for name, before in self._namespaces.items():
+            before = before if isinstance(before, dict) else {}
+            after = dict.get(self._db, name, {})
+            after = after if isinstance(after, dict) else {}
+
+            changed.update(
+                (name, key)
+                for key in before.keys() | after.keys()
+                if before.get(key, MISSING) != after.get(key, MISSING)
+            )
+
+        if self._full:
+            self._db.save()
+
+        for name, key in self._touched - changed:
+            self._db._touch(name, key, reindex=False)
+
+        for name, key in changed:
+            self._db._touch(name, key)
+
+    def _rollback(self) -> None:
+        # A flush made by another task during the transaction may have
+        # written its changes, so everything restored is written again
+        restored = set(self._keys)
+
+        for name, before in self._namespaces.items():
+            for namespace in (before, dict.get(self._db, name)):
+                if isinstance(namespace, dict):
+                    restored.update((name, key) for key in namespace)
+
+        if self._reset:
+            dict.clear(self._db)
+
+        for name, before in self._namespaces.items():
+            if before is MISSING:
+                dict.pop(self._db, name, None)
+            else:
+                dict.__setitem__(self._db, name, before)
+
+        for (name, key), before in self._keys.items():
+            namespace = dict.get(self._db, name)
+
+            if before is not MISSING:
+                dict.setdefault(self._db, name, {})[key] = before
+            elif isinstance(namespace, dict):
+                namespace.pop(key, None)
+
+        self._db._invalidate_indexes()
+
+        if self._reset or self._full:
+            return self._db.save()
+
+        for name, key in restored:
+            self._db._touch(name, key)
 
 
 class Database(LightDB):
     """Local database in the file"""
 
+    def __init__(
+        self,
+        location: str,
+        write_delay: float = WRITE_DELAY,
+        backend: Optional[Backend] = None,
+    ) -> None:
+        """Initializing a class
+
+        Parameters:
+            location (`str`):
+        Path to the database file
+
+            write_delay (`float`, optional):
+        Window in seconds in which writes are coalesced into one save.
+        `0` makes every save synchronous
+
+            backend (`Backend`, optional):
+        Storage engine, picked by the file extension by default
+        """
+        self._backend = backend or from_location(location)
+
+        super().__init__(location)
+
+        self.write_delay = write_delay
+
+        self._changes: Set[Key] = set()
+        self._full = False
+        self._flush_task: asyncio.Task = None
+        self._flush_lock = asyncio.Lock()
+
+        # Keys of the flush running in the executor, by the generation of
+        # its write. A newer write makes older ones skip the disk
+        self._in_flight: Dict[int, Optional[Set[Key]]] = {}
+        self._generation = 0
+        self._written = 0
+        self._write_lock = threading.Lock()
+
+        self._subscribers: Dict[Key, List[Callback]] = {}
+        self._seen: Dict[Key, Any] = {}
+
+        self._sweeper: asyncio.Task = None
+
+        self.replication = None
+
+        self._indexes: Dict[Key, Dict[str, Index]] = {}
+
+        self._key_locks: Dict[Key, threading.RLock] = {}
+        self._key_locks_lock = threading.Lock()
+
+        self._transaction: contextvars.ContextVar[
+            Optional[Transaction]
+        ] = contextvars.ContextVar(f"transaction-{id(self)}", default=None)
+
+        atexit.register(self.flush_sync)
+
     def __repr__(self):
         return object.__repr__(self)
 
-    def set(self, name: str, key: KT, value: VT):
-        self.setdefault(name, {})[key] = value
+    def __missing__(self, name: str) -> Any:
+        if name in self._backend.unloaded:
+            return self._load_namespace(name)
+
+        raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        return dict.__contains__(self, name) or name in self._backend.unloaded
+
+    def _load_namespace(self, name: str) -> Dict[KT, VT]:
+        namespace = self._backend.load_namespace(name)
+        dict.__setitem__(self, name, namespace)
+        return namespace
 
-        return self.save()
+    def _ensure_loaded(self, name: str) -> None:
+        if name in self._backend.unloaded and not dict.__contains__(self, name):
+            self._load_namespace(name)
+
+    def load_all(self) -> None:
+        """Reads every namespace that was not accessed yet"""
+        for name in list(self._backend.unloaded):
+            self._ensure_loaded(name)
+
+    def set(self, name: str, key: KT, value: VT, ttl: Optional[float] = None):
+        """Sets the value, it is removed after `ttl` seconds if given"""
+        self._ensure_loaded(name)
+
+        if transaction := self._transaction.get():
+            transaction._remember_key(name, key)
+
+        super().setdefault(name, {})[key] = value
+
+        if ttl is not None:
+            self._set_deadline(name, key, time.time() + ttl)
+        else:
+            self._set_deadline(name, key, None)
+
+        return self._touch(name, key)
 
     def get(self, name: str, key: KT, default: VT = None):
+        if self._expired(name, key):
+            self.pop(name, key)
+            return default
+
         try:
             return self[name][key]
         except KeyError:
             return default
 
+    def ttl(self, name: str, key: KT) -> Optional[float]:
+        """Returns seconds left until the key expires
+
+        `None` if the key does not expire or does not exist"""
+        if self._expired(name, key):
+            self.pop(name, key)
+            return None
+
+        deadline = self._deadline(name, key)
+        return None if deadline is None else deadline - time.time()
+
     def pop(self, name: str, key: KT = None, default: VT = None):
         if not key:
-            value = self[name].pop(name, default)
+            key = name
+
+        self._ensure_loaded(name)
+
+        if transaction := self._transaction.get():
+            transaction._remember_key(name, key)
+
+        try:
+            value = self[name].pop(key, default)
+        except KeyError:
+            value = default
+
+        self._set_deadline(name, key, None)
+        self._touch(name, key)
+
+        return value if value is not None else default
+
+    def update(self, *args, **kwargs) -> Any:
+        """Atomically replaces the value with the result of a function
+
+        Usage:
+            db.update(name, key, fn, default=None)
+
+        `fn` gets the current value, or `default` if there is none, and
+        returns the new one, which is stored and returned. Called with a
+        single mapping or with keyword arguments it is `dict.update`"""
+        if len(args) < 2:
+            return super().update(*args, **kwargs)
+
+        return self._update(*args, **kwargs)
+
+    def _update(
+        self, name: str, key: KT, fn: Callable[[VT], VT], default: VT = None
+    ) -> VT:
+        with self._key_lock(name, key):
+            # Before `fn` runs, as it may change the stored value in place
+            if transaction := self._transaction.get():
+                transaction._remember_key(name, key)
+
+            value = self.get(name, key, MISSING)
+            value = fn(copy.deepcopy(default) if value is MISSING else value)
+            self.set(name, key, value, ttl=self.ttl(name, key))
+            return value
+
+    def set_record(self, name: str, key: KT, record_id: Any, record: Any) -> None:
+        """Stores one record of the dict under the key
+
+        Unlike `set` with the whole dict, the indexes of the key are
+        updated for this record only instead of comparing all of them"""
+        self._change_record(name, key, record_id, record)
+
+    def pop_record(
+        self, name: str, key: KT, record_id: Any, default: Any = None
+    ) -> Any:
+        """Removes one record of the dict under the key, returns it"""
+        return self._change_record(name, key, record_id, MISSING, default)
+
+    def _change_record(
+        self, name: str, key: KT, record_id: Any, record: Any, default: Any = None
+    ) -> Any:
+        with self._key_lock(name, key):
+            records = self.get(name, key, MISSING)
+
+            if not isinstance(records, dict):
+                if record is not MISSING:
+                    self.set(name, key, {record_id: record})
+
+                return default
+
+            if transaction := self._transaction.get():
+                transaction._remember_key(name, key)
+
+            if record is MISSING:
+                old = records.pop(record_id, default)
+            else:
+                old, records[record_id] = records.get(record_id, default), record
+
+            for index in self._indexes.get((name, key), {}).values():
+                if not index.dirty:
+                    index.put(record_id, record)
+
+            self._touch(name, key, reindex=False)
+            return old
+
+    def add_to_set(self, name: str, key: KT, *items: Any) -> List[Any]:
+        """Adds the items to the list under the key, skipping those already in it"""
+
+        def add(value: List[Any]) -> List[Any]:
+            value = list(value)
+
+            for item in items:
+                if item not in value:
+                    value.append(item)
+
+            return value
+
+        return self.update(name, key, add, [])
+
+    def remove_from_set(self, name: str, key: KT, *items: Any) -> List[Any]:
+        """Removes the items from the list under the key"""
+        return self.update(
+            name, key, lambda value: [item for item in value if item not in items], []
+        )
+
+    def _key_lock(self, name: str, key: KT) -> threading.RLock:
+        with self._key_locks_lock:
+            return self._key_locks.setdefault((name, key), threading.RLock())
+
+    def drop(self, name: str) -> Dict[KT, VT]:
+        """Removes the whole namespace, returns its contents"""
+        self._ensure_loaded(name)
+
+        if transaction := self._transaction.get():
+            transaction._remember_namespace(name)
+
+        if (namespace := dict.pop(self, name, MISSING)) is MISSING:
+            return {}
+
+        for key in namespace if isinstance(namespace, dict) else ():
+            self._touch(name, key)
+
+        if not namespace:
+            self.save()
+
+        if name in dict.get(self, EXPIRE_NAMESPACE, {}):
+            if transaction:
+                transaction._remember_key(EXPIRE_NAMESPACE, name)
+
+            del self[EXPIRE_NAMESPACE][name]
+            self._touch(EXPIRE_NAMESPACE, name)
+
+        return namespace
+
+    def setdefault(self, name: str, default: Any = None) -> Any:
+        self._ensure_loaded(name)
+
+        if transaction := self._transaction.get():
+            transaction._remember_namespace(name)
+
+        return super().setdefault(name, default)
+
+    def reset(self) -> None:
+        self.load_all()
+
+        if transaction := self._transaction.get():
+            for name in self:
+                transaction._remember_namespace(name)
+
+            transaction._reset = transaction._full = True
+
+        return super().reset()
+
+    def _deadline(self, name: str, key: KT) -> Optional[float]:
+        expire = dict.get(self, EXPIRE_NAMESPACE)
+        return expire[name].get(key) if expire and name in expire else None
+
+    def _expired(self, name: str, key: KT) -> bool:
+        deadline = self._deadline(name, key)
+        return deadline is not None and deadline <= time.time()
+
+    def _set_deadline(self, name: str, key: KT, deadline: Optional[float]) -> None:
+        expire = dict.get(self, EXPIRE_NAMESPACE)
+
+        if deadline is None and not (expire and key in expire.get(name, ())):
+            return
+
+        if transaction := self._transaction.get():
+            transaction._remember_key(EXPIRE_NAMESPACE, name)
+
+        deadlines = super().setdefault(EXPIRE_NAMESPACE, {}).setdefault(name, {})
+
+        if deadline is None:
+            deadlines.pop(key, None)
         else:
+            deadlines[key] = deadline
+
+        if not deadlines:
+            del self[EXPIRE_NAMESPACE][name]
+
+        self._touch(EXPIRE_NAMESPACE, name)
+
+    def sweep(self, limit: int = SWEEP_BATCH) -> int:
+        """Removes up to `limit` expired keys, returns their number"""
+        now = time.time()
+        expired = [
+            (name, key)
+            for name, deadlines in dict.get(self, EXPIRE_NAMESPACE, {}).items()
+            for key, deadline in deadlines.items()
+            if deadline <= now
+        ][:limit]
+
+        with self.transaction():
+            for name, key in expired:
+                self.pop(name, key)
+
+        return len(expired)
+
+    def start_sweeper(self, interval: float = SWEEP_INTERVAL) -> None:
+        """Starts removing expired keys in the background"""
+        if not self._sweeper:
+            self._sweeper = asyncio.ensure_future(self._sweep_forever(interval))
+
+    def stop_sweeper(self) -> None:
+        if self._sweeper:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_forever(self, interval: float) -> None:
+        while True:
             try:
-                value = self[name].pop(key, default)
-            except KeyError:
-                value = default
+                while self.sweep() == SWEEP_BATCH:
+                    await asyncio.sleep(0)
+            except Exception:
+                logger.exception("Failed to remove expired keys")
+
+            await asyncio.sleep(interval)
+
+    def transaction(self) -> Transaction:
+        """Returns a context manager that commits all changes at once
+
+        Usage:
+            with db.transaction():
+                ...
+        """
+        return Transaction(self)
+
+    def batch(self) -> Transaction:
+        """Same as `transaction`, meant for `async with db.batch():`"""
+        return Transaction(self)
+
+    @property
+    def _dirty(self) -> bool:
+        return self._full or bool(self._changes)
+
+    def _load(self) -> Dict[str, Any]:
+        return self._backend.load()
 
+    def subscribe(self, name: str, key: KT, callback: Callback) -> Callable[[], None]:
+        """Calls `callback(name, key, value)` every time the value changes
+
+        Returns a function that cancels the subscription"""
+        subscribers = self._subscribers.setdefault((name, key), [])
+        subscribers.append(callback)
+        self._seen.setdefault((name, key), _copy(self.get(name, key, MISSING)))
+
+        def unsubscribe():
+            if callback in subscribers:
+                subscribers.remove(callback)
+
+            if not subscribers and self._subscribers.get((name, key)) is subscribers:
+                del self._subscribers[(name, key)]
+                self._seen.pop((name, key), None)
+
+        return unsubscribe
+
+    async def watch(self, name: str, key: KT) -> AsyncIterator[VT]:
+        """Yields the new value every time it changes"""
+        queue = asyncio.Queue()
+        unsubscribe = self.subscribe(
+            name, key, lambda _name, _key, value: queue.put_nowait(value)
+        )
+
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            unsubscribe()
+
+    def _notify(self, name: str, key: KT) -> None:
+        if not (subscribers := self._subscribers.get((name, key))):
+            return
+
+        value = self.get(name, key, MISSING)
+
+        if value == self._seen.get((name, key), MISSING):
+            return
+
+        self._seen[(name, key)] = _copy(value)
+        value = None if value is MISSING else value
+
+        for callback in subscribers.copy():
+            try:
+                callback(name, key, value)
+            except Exception:
+                logger.exception("Error in database subscriber %s", callback)
+
+    def create_index(self, name: str, key: KT, field: str) -> None:
+        """Indexes a field of the records stored under the key for `query`
+
+        The value must be a dict of `record id -> record dict`. Indexes
+        live in memory and are rebuilt on the first query after a start"""
+        self._indexes.setdefault((name, key), {}).setdefault(field, Index(field))
+
+    def drop_index(self, name: str, key: KT, field: str) -> None:
+        self._indexes.get((name, key), {}).pop(field, None)
+
+    def query(self, name: str, key: KT, where: Dict[str, Any]) -> Dict[Any, Any]:
+        """Returns the records under the key matching all the conditions
+
+        A condition is either a value the field must be equal to or a
+        `slice(low, high)` selecting `low <= field < high`. Indexed fields
+        are looked up in their index, the others are compared one by one.
+        Write records with `set_record` to keep the indexes up to date
+        without a scan
+
+        Usage:
+            db.query("MyMod", "users", where={"chat": chat_id})
+            db.query("MyMod", "users", where={"seen": slice(time.time() - 60, None)})
+        """
+        records = self.get(name, key, {})
+
+        if not isinstance(records, dict):
+            return {}
+
+        indexes = self._indexes.get((name, key), {})
+        result = None
+
+        # Indexed fields first, so that the rest only checks their matches
+        for field, condition in sorted(
+            where.items(), key=lambda item: item[0] not in indexes
+        ):
+            try:
+                matched = self._lookup(indexes[field], records, condition)
+            except (KeyError, TypeError):
+                matched = [
+                    record_id
+                    for record_id in (records if result is None else result)
+                    if isinstance(records[record_id], dict)
+                    and _matches(records[record_id].get(field, MISSING), condition)
+                ]
+
+            if result is None:
+                result = matched
+            else:
+                allowed = set(matched)
+                result = [record_id for record_id in result if record_id in allowed]
+
+            if not result:
+                return {}
+
+        return {record_id: records[record_id] for record_id in result or records}
+
+    @staticmethod
+    def _lookup(index: Index, records: Dict[Any, Any], condition: Any) -> List[Any]:
+        index.refresh(records)
+
+        if isinstance(condition, slice):
+            return index.between(condition.start, condition.stop)
+
+        return index.equal(condition)
+
+    def _invalidate_indexes(self) -> None:
+        for indexes in self._indexes.values():
+            for index in indexes.values():
+                index.dirty = True
+
+    def _touch(self, name: str, key: KT, reindex: bool = True) -> None:
+        if reindex and (name, key) in self._indexes:
+            for index in self._indexes[(name, key)].values():
+                index.dirty = True
+
+        if transaction := self._transaction.get():
+            return transaction._touched.add((name, key))
+
+        self._changes.add((name, key))
+        self._schedule()
+        self._notify(name, key)
+
+    def save(self) -> None:
+        """Marks the whole database as changed and schedules a write"""
+        if transaction := self._transaction.get():
+            transaction._full = True
+            return
+
+        self._full = True
+        self._schedule()
+        self._invalidate_indexes()
+
+        for name, key in list(self._subscribers):
+            self._notify(name, key)
+
+    def _schedule(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if not self.write_delay or loop is None:
+            return self.flush_sync()
+
+        if not self._flush_task:
+            self._flush_task = loop.create_task(self._delayed_flush())
+
+    def _take_changes(self) -> Optional[Set[Key]]:
+        keys = None if self._full else self._changes
+        self._changes, self._full = set(), False
+        return keys
+
+    def _restore_changes(self, keys: Optional[Set[Key]]) -> None:
+        if keys is None:
+            self._full = True
+        else:
+            self._changes |= keys
+
+    async def flush(self) -> None:
+        """Writes pending changes to the disk right now"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            keys = self._take_changes()
+            loop = asyncio.get_running_loop()
+
+            self._generation += 1
+            generation = self._generation
+            self._in_flight[generation] = keys
+
+            try:
+                scope = self._backend.scope(keys)
+                data = self._backend.snapshot(self, scope)
+
+                payload = await loop.run_in_executor(
+                    None, self._backend.encode, data, scope
+                )
+                await loop.run_in_executor(None, self._write, generation, payload)
+            except Exception:
+                self._restore_changes(keys)
+                raise
+            finally:
+                del self._in_flight[generation]
+
+            self._replicate(keys)
+
+    async def compact(self) -> None:
+        """Rewrites the whole database and reclaims the space of removed data"""
         self.save()
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(None, self._backend.compact)
 
-        return value if value is not None else default
+    def flush_sync(self) -> None:
+        """Writes pending changes to the disk, blocking the caller"""
+        for keys in self._in_flight.values():
+            # The executor may never finish that write, e.g. when the
+            # process restarts right after, so it is repeated here
+            self._restore_changes(keys)
+
+        if not self._dirty:
+            return
+
+        keys = self._take_changes()
+        self._generation += 1
+
+        try:
+            scope = self._backend.scope(keys)
+            self._write(self._generation, self._backend.encode(self, scope))
+        except Exception:
+            self._restore_changes(keys)
+            raise
+
+        self._replicate(keys)
+
+    def _write(self, generation: int, payload: Any) -> None:
+        with self._write_lock:
+            if generation < self._written:
+                return
+
+            self._backend.write(payload)
+            self._written = generation
+
+    def _replicate(self, keys: Optional[Set[Key]]) -> None:
+        if not self.replication:
+            return
+
+        try:
+            self.replication.publish(keys)
+        except Exception:
+            logger.exception("Failed to replicate database changes")
+
+    async def _delayed_flush(self) -> None:
+        try:
+            await asyncio.sleep(self.write_delay)
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to save the database")
+        finally:
+            self._flush_task = None
+
+            if self._dirty:
+                self._schedule()
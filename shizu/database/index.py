@@ -0,0 +1,128 @@
+import bisect
+
+from typing import Any, Dict, Hashable, List, Set
+
+ABSENT = object()
+
+
+class Index:
+    """Secondary index over one field of the records stored under a key
+
+    The records are a dict of `record id -> record`. Equal values are
+    looked up in a hash map, ranges in a sorted list that is built on the
+    first range lookup. Records written one by one are indexed with `put`
+    right away. After the whole dict is replaced the index is marked dirty
+    and refreshed on the next lookup by comparing every record with the
+    value it has seen"""
+
+    def __init__(self, field: str) -> None:
+        self.field = field
+        self.dirty = True
+
+        self._values: Dict[Hashable, Any] = {}
+        self._buckets: Dict[Hashable, Set[Hashable]] = {}
+
+        self._sorted = False
+        self._keys: List[Any] = []
+        self._ids: List[Hashable] = []
+
+    def refresh(self, records: Any) -> None:
+        """Brings the index up to date with the records"""
+        if not self.dirty:
+            return
+
+        records = records if isinstance(records, dict) else {}
+
+        for record_id in [i for i in self._values if i not in records]:
+            self._remove(record_id)
+
+        for record_id, record in records.items():
+            self.put(record_id, record)
+
+        self.dirty = False
+
+    def put(self, record_id: Hashable, record: Any) -> None:
+        """Reindexes one record, a record that is not a dict is dropped"""
+        value = ABSENT
+
+        if isinstance(record, dict):
+            value = record.get(self.field, ABSENT)
+
+        old = self._values.get(record_id, ABSENT)
+
+        if value is old or ABSENT not in (value, old) and value == old:
+            return
+
+        if old is not ABSENT:
+            self._remove(record_id)
+
+        if value is not ABSENT:
+            self._add(record_id, value)
+
+    def equal(self, value: Any) -> List[Hashable]:
+        """Ids of the records whose field equals the value"""
+        try:
+            return list(self._buckets.get(value, ()))
+        except TypeError:
+            return [i for i, v in self._values.items() if v == value]
+
+    def between(self, low: Any = None, high: Any = None) -> List[Hashable]:
+        """Ids of the records with `low <= field < high`, ordered by the field
+
+        `None` leaves the bound open"""
+        if not self._sorted:
+            pairs = sorted(
+                ((value, record_id) for record_id, value in self._values.items()),
+                key=lambda pair: pair[0],
+            )
+            self._keys = [value for value, _ in pairs]
+            self._ids = [record_id for _, record_id in pairs]
+            self._sorted = True
+
+        start = 0 if low is None else bisect.bisect_left(self._keys, low)
+        end = len(self._keys)
+
+        if high is not None:
+            end = bisect.bisect_left(self._keys, high)
+
+        return self._ids[start:end]
+
+    def _add(self, record_id: Hashable, value: Any) -> None:
+        self._values[record_id] = value
+
+        try:
+            self._buckets.setdefault(value, set()).add(record_id)
+        except TypeError:
+            pass
+
+        if self._sorted:
+            try:
+                position = bisect.bisect_right(self._keys, value)
+            except TypeError:
+                self._sorted = False
+            else:
+                self._keys.insert(position, value)
+                self._ids.insert(position, record_id)
+
+    def _remove(self, record_id: Hashable) -> None:
+        value = self._values.pop(record_id)
+
+        try:
+            bucket = self._buckets.get(value, set())
+            bucket.discard(record_id)
+
+            if not bucket:
+                self._buckets.pop(value, None)
+        except TypeError:
+            pass
+
+        if self._sorted:
+            try:
+                start = bisect.bisect_left(self._keys, value)
+                end = bisect.bisect_right(self._keys, value)
+                position = self._ids.index(record_id, start, end)
+            except (TypeError, ValueError):
+                self._sorted = False
+            else:
+                del self._keys[position]
+                del self._ids[position]
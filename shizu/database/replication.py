@@ -0,0 +1,330 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Union
+
+from .backends import Key, _dumps, copy_data
+
+if TYPE_CHECKING:
+    from .frontend import Database
+
+logger = logging.getLogger(__name__)
+
+SOCKET_LOCATION = "./db.replication.sock"
+LOG_LOCATION = "./db.replog"
+POSITION = ("shizu.replica", "position")
+RETRY_DELAY = 1.0
+
+
+class SameDatabaseError(RuntimeError):
+    """The standby and the primary use the same database files"""
+
+
+def location(db: "Database") -> str:
+    """Absolute path of the database files"""
+    return str(db._backend.location.resolve())
+
+
+class ReplicationLog:
+    """Append-only log of written changes numbered with sequence numbers
+
+    The first line names the epoch of the log and the first sequence
+    number it holds. A full save starts the log anew, standbys that are
+    behind the start of the log receive a snapshot instead.
+
+    Records are numbered with `number` on the loop, the other methods do
+    file I/O and are meant to run one at a time in an executor"""
+
+    def __init__(
+        self, location: str = LOG_LOCATION, max_size: int = 16 * 1024 * 1024
+    ) -> None:
+        self.location = Path(location)
+        self.max_size = max_size
+
+        self.epoch = uuid.uuid4().hex
+        self.first = self.last = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.location.exists():
+            return self.reset(1)
+
+        with self.location.open("r", encoding="utf-8") as file:
+            lines = file.read().splitlines()
+
+        try:
+            header = json.loads(lines[0])
+            self.epoch, self.first = header["epoch"], header["first"]
+            self.last = self.first - 1
+
+            for line in lines[1:]:
+                self.last = json.loads(line)["seq"]
+        except (IndexError, KeyError, ValueError):
+            logger.warning("Replication log is broken, starting a new one")
+            self.epoch = uuid.uuid4().hex
+            self.reset(self.last + 1)
+
+    def reset(self, first: int) -> None:
+        """Drops all records, the next one gets the `first` number"""
+        self.last = first - 1
+        self.restart(first)
+
+    def number(self, records: List[Dict[str, Any]]) -> None:
+        """Gives the records the next sequence numbers"""
+        for record in records:
+            self.last += 1
+            record["seq"] = self.last
+
+    def append(self, records: List[Dict[str, Any]]) -> None:
+        """Writes numbered records to the end of the log"""
+        with self.location.open("a", encoding="utf-8") as file:
+            file.write("".join(_dumps(record) + "\n" for record in records))
+
+        if self.location.stat().st_size > self.max_size:
+            self.restart(records[-1]["seq"] + 1)
+
+    def restart(self, first: int) -> None:
+        """Drops the written records, keeping the numbering"""
+        self.first = first
+
+        with self.location.open("w", encoding="utf-8") as file:
+            file.write(_dumps({"epoch": self.epoch, "first": first}) + "\n")
+
+    def read_since(self, epoch: Optional[str], seq: int) -> Optional[List[Dict]]:
+        """Returns the records after `seq`, `None` if the log does not have them"""
+        if epoch != self.epoch or not self.first - 1 <= seq <= self.last:
+            return None
+
+        with self.location.open("r", encoding="utf-8") as file:
+            records = [json.loads(line) for line in file.read().splitlines()[1:]]
+
+        return [record for record in records if record["seq"] > seq]
+
+
+class ReplicationServer:
+    """Streams the changes of the database to standbys over a UNIX socket
+
+    A standby says which epoch and sequence number it has applied, gets
+    the missed records from the log, or a snapshot if they are gone, and
+    then every change as soon as it is written to the disk"""
+
+    def __init__(
+        self,
+        db: "Database",
+        path: str = SOCKET_LOCATION,
+        log: Optional[ReplicationLog] = None,
+    ) -> None:
+        self.db = db
+        self.path = path
+        self.log = log or ReplicationLog()
+
+        self._clients: Set[asyncio.Queue] = set()
+        self._server: asyncio.AbstractServer = None
+        self._log_task: Optional[asyncio.Future] = None
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+        self.db.replication = self
+
+        # Changes written before the server was attached are not in the log
+        self.publish(None)
+        logger.info("Serving database replication on %s", self.path)
+
+    async def stop(self) -> None:
+        self.db.replication = None
+
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def publish(self, keys: Optional[Set[Key]]) -> None:
+        """Sends the written keys, or a snapshot if `keys` is None"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Saved on exit, nobody is served anymore
+            return self._publish_sync(keys)
+
+        records: List[Union[Dict[str, Any], asyncio.Future]]
+
+        if keys is None:
+            self.log.last += 1
+            records = [self._snapshot(self.log.last)]
+            task = self._in_log(self.log.restart, self.log.last + 1)
+        else:
+            records = [self._record(name, key) for name, key in keys]
+            self.log.number(records)
+            task = self._in_log(self.log.append, records)
+
+        task.add_done_callback(_report)
+
+        for queue in self._clients:
+            queue.put_nowait(records)
+
+    def _publish_sync(self, keys: Optional[Set[Key]]) -> None:
+        if keys is None:
+            return self.log.reset(self.log.last + 2)
+
+        records = [self._record(name, key) for name, key in keys]
+        self.log.number(records)
+        self.log.append(records)
+
+    def _in_log(self, func: Callable, *args) -> asyncio.Future:
+        """Runs log I/O in an executor once the I/O scheduled before is done"""
+        previous = self._log_task
+
+        async def run() -> Any:
+            if previous:
+                await asyncio.wait([previous])
+
+            return await asyncio.get_running_loop().run_in_executor(
+                None, func, *args
+            )
+
+        self._log_task = asyncio.ensure_future(run())
+        return self._log_task
+
+    def _record(self, name: str, key: Any) -> Dict[str, Any]:
+        try:
+            value = dict.__getitem__(self.db, name)[key]
+        except (KeyError, TypeError):
+            return {"op": "pop", "name": name, "key": str(key)}
+
+        return {"op": "set", "name": name, "key": str(key), "value": copy_data(value)}
+
+    def _snapshot(self, seq: int) -> asyncio.Future:
+        """Copies the database as of now, the future resolves to the record"""
+        data = copy_data({name: value for name, value in dict.items(self.db)})
+        epoch = self.log.epoch
+
+        # Namespaces that were not read yet come from the disk, without
+        # loading them into the primary
+        unloaded = set(self.db._backend.unloaded) - data.keys()
+
+        async def read() -> Dict[str, Any]:
+            data.update(
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._read_unloaded, unloaded
+                )
+            )
+
+            return {"seq": seq, "epoch": epoch, "op": "snapshot", "data": data}
+
+        return asyncio.ensure_future(read())
+
+    def _read_unloaded(self, names: Set[str]) -> Dict[str, Any]:
+        data = {}
+
+        for name in names:
+            try:
+                data[name] = self.db._backend.read_namespace(name)
+            except (KeyError, OSError):
+                # Loaded and removed meanwhile, the records that follow tell
+                continue
+
+        return data
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        queue = asyncio.Queue()
+        self._clients.add(queue)
+
+        try:
+            # Lets the standby check that it does not share the files with us
+            writer.write((_dumps({"location": location(self.db)}) + "\n").encode())
+            await writer.drain()
+
+            hello = json.loads(await reader.readline())
+            backlog = await self._in_log(
+                self.log.read_since, hello.get("epoch"), hello.get("seq", 0)
+            )
+
+            if backlog is None:
+                backlog = [await self._snapshot(self.log.last)]
+
+            snapshot = backlog and backlog[0]["op"] == "snapshot"
+            sent = -1 if snapshot else hello.get("seq", 0)
+
+            while True:
+                for record in backlog:
+                    if isinstance(record, asyncio.Future):
+                        record = await record
+
+                    if record["seq"] > sent:
+                        writer.write((_dumps(record) + "\n").encode("utf-8"))
+                        sent = record["seq"]
+
+                await writer.drain()
+                backlog = await queue.get()
+        except (ConnectionError, ValueError, AttributeError) as error:
+            logger.info("Standby disconnected: %s", error)
+        finally:
+            self._clients.discard(queue)
+            writer.close()
+
+
+def _report(task: asyncio.Future) -> None:
+    if not task.cancelled() and (error := task.exception()):
+        logger.error("Failed to write the replication log", exc_info=error)
+
+
+def apply(db: "Database", record: Dict[str, Any]) -> None:
+    """Applies a record of the replication stream to the database"""
+    with db.transaction():
+        if record["op"] == "snapshot":
+            db.reset()
+            db.update(**record["data"])
+            epoch = record["epoch"]
+        else:
+            epoch = db.get(*POSITION, {}).get("epoch")
+
+            if record["op"] == "set":
+                db.set(record["name"], record["key"], record["value"])
+            else:
+                db.pop(record["name"], record["key"])
+
+        db.set(*POSITION, {"epoch": epoch, "seq": record["seq"]})
+
+
+async def follow(db: "Database", path: str) -> None:
+    """Keeps the database in sync with the primary until cancelled
+
+    Raises `SameDatabaseError` if the primary writes the same files"""
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+        except OSError:
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+
+        try:
+            primary = json.loads(await reader.readline())
+
+            if primary.get("location") == location(db):
+                raise SameDatabaseError(
+                    f"The standby would write over the database of the primary"
+                    f" ({primary['location']}), run it from another directory"
+                )
+
+            position = db.get(*POSITION, {})
+            writer.write((_dumps(position) + "\n").encode("utf-8"))
+            await writer.drain()
+
+            logger.info("Following the primary from %s", position.get("seq", 0))
+
+            while line := await reader.readline():
+                apply(db, json.loads(line))
+        except (ConnectionError, ValueError, KeyError) as error:
+            logger.warning("Lost the primary: %s", error)
+        finally:
+            writer.close()
+
+        await asyncio.sleep(RETRY_DELAY)
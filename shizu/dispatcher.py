@@ -13,30 +13,43 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import random
 import contextlib
 import logging
+import os
 import sys
+import time
 import traceback
 
 import inspect
 
+from collections import OrderedDict
 from types import FunctionType
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
 
 from pyrogram import Client, filters, types, raw
 from pyrogram.handlers import MessageHandler, EditedMessageHandler
 
-from . import loader, utils, database, logger as lo
+from . import loader, metrics, utils, permissions, logger as lo
 
 logger = logging.getLogger(__name__)
 
+WATCHER_LIMIT = 32
+WATCHER_TIMEOUT = 30.0
+WATCHER_SLOW = 1.0
+COMMAND_LIMIT = 16
+READ_INTERVAL = 2.0
+EDIT_CACHE_SIZE = 2048
+EDIT_DEBOUNCE = 0.5
+REPORT_WINDOW = 300
+
 
 async def check_filters(
     func: FunctionType,
     app: Client,
     message: types.Message,
 ) -> bool:
-    db = database.db
     if custom_filters := getattr(func, "_filters", None):
         coro = custom_filters(app, message)
 
@@ -46,38 +59,358 @@ async def check_filters(
         if not coro:
             return False
 
-    if message.from_user.is_self:
+    if message.from_user and message.from_user.is_self:
         return True
 
-    if (
+    snapshot = permissions.perms.snapshot
+
+    if snapshot.owner_mode and (
         message.sender_chat.id if message.from_user is None else message.from_user.id
-    ) in db.get("shizu.me", "owners", []) and db.get("shizu.owner", "status", False):
+    ) in snapshot.owners:
         return True
 
     return bool(message.outgoing)
 
 
+class WatcherRouter:
+    """Picks the watchers a message can concern
+
+    Watchers declared with `loader.watcher` are indexed by the chats and
+    the direction they want, so a message only goes through the watchers
+    of its own chat and the global ones instead of all of them"""
+
+    def __init__(self) -> None:
+        self._source: List[FunctionType] = None
+        self._size = -1
+
+        self._global: Dict[bool, List[FunctionType]] = {True: [], False: []}
+        self._chats: Dict[Tuple[int, bool], List[FunctionType]] = {}
+
+    def rebuild(self, watchers: List[FunctionType]) -> None:
+        """Indexes the watchers, keeping their order"""
+        self._source, self._size = watchers, len(watchers)
+        self._global = {True: [], False: []}
+        chats: Dict[Tuple[int, bool], List[Tuple[int, FunctionType]]] = {}
+
+        for position, watcher in enumerate(watchers):
+            watcher_filter = getattr(watcher, "_watcher_filter", None)
+            directions = [True, False]
+
+            if watcher_filter and watcher_filter.outgoing is not None:
+                directions = [watcher_filter.outgoing]
+
+            for outgoing in directions:
+                if not watcher_filter or watcher_filter.chats is None:
+                    self._global[outgoing].append((position, watcher))
+                    continue
+
+                for chat_id in watcher_filter.chats:
+                    chats.setdefault((chat_id, outgoing), []).append(
+                        (position, watcher)
+                    )
+
+        # Chat watchers are merged with the global ones once, here
+        self._chats = {
+            key: [
+                watcher
+                for _, watcher in sorted(
+                    self._global[key[1]] + items, key=lambda item: item[0]
+                )
+            ]
+            for key, items in chats.items()
+        }
+        self._global = {
+            outgoing: [watcher for _, watcher in items]
+            for outgoing, items in self._global.items()
+        }
+
+    def route(
+        self, watchers: List[FunctionType], message: types.Message
+    ) -> List[FunctionType]:
+        """Returns the watchers to call for the message"""
+        if watchers is not self._source or len(watchers) != self._size:
+            self.rebuild(watchers)
+
+        outgoing = bool(message.outgoing)
+        candidates = self._chats.get(
+            (message.chat.id if message.chat else None, outgoing),
+            self._global[outgoing],
+        )
+
+        return [
+            watcher
+            for watcher in candidates
+            if not hasattr(watcher, "_watcher_filter")
+            or watcher._watcher_filter.check(message)
+        ]
+
+
+class EditCoalescer:
+    """Drops edits that do not change a message and debounces bursts of edits
+
+    The content of the messages seen lately is remembered by its hash, an
+    edit with the same content (a reaction, a changed `edit_date`) is not
+    dispatched. Edits of one message that follow each other within
+    `shizu.dispatcher/edit_debounce` seconds are dispatched once, with the
+    last version of the message"""
+
+    def __init__(self, app: Client, size: int = EDIT_CACHE_SIZE) -> None:
+        self.app = app
+        self.size = size
+
+        self._seen: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._pending: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _key(message: types.Message) -> Tuple[int, int]:
+        return (message.chat.id if message.chat else 0, message.id)
+
+    @staticmethod
+    def _digest(message: types.Message) -> int:
+        return hash(
+            (
+                message.text,
+                message.caption,
+                message.media.value if message.media else None,
+            )
+        )
+
+    def remember(self, message: types.Message) -> bool:
+        """Stores the content of the message, returns False if it is unchanged"""
+        key, digest = self._key(message), self._digest(message)
+
+        if self._seen.get(key) == digest:
+            self._seen.move_to_end(key)
+            return False
+
+        self._seen[key] = digest
+        self._seen.move_to_end(key)
+
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+
+        return True
+
+    def submit(
+        self,
+        message: types.Message,
+        callback: Callable[[types.Message], Awaitable],
+    ) -> None:
+        """Schedules the edited message to be dispatched, unless nothing changed"""
+        if not self.remember(message):
+            return
+
+        key = self._key(message)
+
+        if pending := self._pending.pop(key, None):
+            pending.cancel()
+
+        self._pending[key] = asyncio.get_running_loop().call_later(
+            self.app.db.get("shizu.dispatcher", "edit_debounce", EDIT_DEBOUNCE),
+            self._dispatch,
+            key,
+            message,
+            callback,
+        )
+
+    def _dispatch(
+        self,
+        key: Tuple[int, int],
+        message: types.Message,
+        callback: Callable[[types.Message], Awaitable],
+    ) -> None:
+        self._pending.pop(key, None)
+
+        task = asyncio.create_task(callback(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+class ErrorReporter:
+    """Reports failures of commands to the logs chat, once per kind of failure
+
+    A failure is fingerprinted by the command, the type of the exception
+    and the frame that raised it. The first one is reported in full, the repeats within
+    `REPORT_WINDOW` seconds after it are only counted and summed up in one
+    message when the window closes"""
+
+    def __init__(self, app: Client, window: float = REPORT_WINDOW) -> None:
+        self.app = app
+        self.window = window
+
+        self._repeats: Dict[Tuple[str, str, str, int], int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def fingerprint(command: str, error: BaseException) -> Tuple[str, str, str, int]:
+        filename, lineno = "", 0
+
+        for frame, lineno in traceback.walk_tb(error.__traceback__):
+            filename = frame.f_code.co_filename
+
+        return (command, type(error).__name__, filename, lineno)
+
+    def count(self, command: str, error: BaseException, title: str) -> bool:
+        """Counts the failure, returns True if it has to be reported in full"""
+        key = self.fingerprint(command, error)
+
+        if key in self._repeats:
+            self._repeats[key] += 1
+            return False
+
+        self._repeats[key] = 0
+        asyncio.get_running_loop().call_later(self.window, self._close, key, title)
+        return True
+
+    def _close(self, key: Tuple[str, str, str, int], title: str) -> None:
+        if repeats := self._repeats.pop(key, 0):
+            task = asyncio.create_task(self._summarize(key, title, repeats))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(
+        self, key: Tuple[str, str, str, int], title: str, repeats: int
+    ) -> None:
+        _, error, filename, lineno = key
+
+        with contextlib.suppress(Exception):
+            await self.app.inline_bot.send_message(
+                self.app.db.get("shizu.chat", "logs", None),
+                f"🔁 <b>{title}</b>\n<code>{error}</code> <b>at</b>"
+                f" <code>{utils.escape_html(os.path.basename(filename))}:{lineno}</code>"
+                f" <b>×{repeats} in last {round(self.window / 60)} min</b>",
+                parse_mode="HTML",
+            )
+
+
+class ReadAcknowledger:
+    """Marks chats as read in batches
+
+    Commands only mark their chat as dirty, every dirty chat is read once
+    per `shizu.dispatcher/read_interval` seconds in the background instead
+    of a request after each command. Chats listed in
+    `shizu.dispatcher/noread_chats` are left unread"""
+
+    def __init__(self, app: Client) -> None:
+        self.app = app
+        self._dirty: Set[int] = set()
+        self._task: asyncio.Task = None
+
+    def mark(self, chat_id: int) -> None:
+        """Schedules the chat to be read"""
+        if chat_id not in self.app.db.get("shizu.dispatcher", "noread_chats", []):
+            self._dirty.add(chat_id)
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._loop())
+
+    async def flush(self) -> None:
+        """Reads all dirty chats now"""
+        dirty, self._dirty = self._dirty, set()
+
+        for chat_id in dirty:
+            try:
+                await self.app.read_chat_history(chat_id)
+            except Exception as error:
+                logger.debug("Could not read chat %s: %s", chat_id, error)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(
+                self.app.db.get("shizu.dispatcher", "read_interval", READ_INTERVAL)
+            )
+            await self.flush()
+
+
+class CommandTask:
+    """Command running, or waiting for its turn in the chat, as a task"""
+
+    def __init__(
+        self, id_: int, command: str, module: str, chat_id: int, task: asyncio.Task
+    ) -> None:
+        self.id = id_
+        self.command = command
+        self.module = module
+        self.chat_id = chat_id
+        self.task = task
+        self.started = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        """Seconds since the command was received"""
+        return time.monotonic() - self.started
+
+
 class DispatcherManager:
     """Manager of dispatcher"""
 
     def __init__(self, app: Client, modules: "loader.ModulesManager") -> None:
         self.app = app
         self.modules = modules
+        self.router = WatcherRouter()
+        self.read_acknowledger = ReadAcknowledger(app)
+        self.edits = EditCoalescer(app)
+        self.errors = ErrorReporter(app)
+        self.recorder = None
+
+        if trace := os.environ.get("SHIZU_RECORD"):
+            from .replay import Recorder
+
+            self.recorder = Recorder(trace)
+
+        self._watcher_semaphore = asyncio.Semaphore(
+            app.db.get("shizu.dispatcher", "watcher_limit", WATCHER_LIMIT)
+        )
+        self._watcher_tasks: Set[asyncio.Task] = set()
+
+        self.running: Dict[int, CommandTask] = {}
+        self._last_task_id = 0
+        self._command_semaphore = asyncio.Semaphore(
+            app.db.get("shizu.dispatcher", "command_limit", COMMAND_LIMIT)
+        )
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_queued: Dict[int, int] = {}
 
     async def load(self) -> bool:
         """Loads dispatcher"""
         self.app.add_handler(handler=MessageHandler(self._handle_message, filters.all))
         self.app.add_handler(
-            handler=EditedMessageHandler(self._handle_message, filters.all),
+            handler=EditedMessageHandler(self._handle_edited, filters.all),
             group=random.randint(1, 1000),
         )
+        self.read_acknowledger.start()
 
         return True
 
+    async def _handle_edited(self, app: Client, message: types.Message) -> None:
+        """Handle edited message once its edits settle"""
+        if self.recorder:
+            self.recorder.write(message, True)
+
+        self.edits.submit(
+            message, lambda edited: self._handle_message(app, edited, True)
+        )
+
     async def _handle_message(
-        self, app: Client, message: types.Message
+        self, app: Client, message: types.Message, edited: bool = False
     ) -> types.Message:
         """Handle message"""
+        if not edited:
+            self.edits.remember(message)
+
+            if self.recorder:
+                self.recorder.write(message)
+
+            if message.date:
+                metrics.registry.observe(
+                    "lag",
+                    "telegram",
+                    "message",
+                    max(time.time() - message.date.timestamp(), 0) * 1000,
+                )
+
         await self._handle_watchers(app, message)
 
         prefix, command, args = utils.get_full_command(message)
@@ -85,19 +418,99 @@ class DispatcherManager:
             return
 
         command = self.modules.aliases.get(command, command)
-        func = self.modules.command_handlers.get(command.lower())
+        func = self.modules.command_handlers.get(command)
 
-        if not func:
+        if not func or edited and not getattr(func, "_rerun_on_edit", False):
             return
 
         if not await check_filters(func, app, message):
             return
 
+        self._last_task_id += 1
+        task_id = self._last_task_id
+        task = asyncio.create_task(
+            self._run_command(task_id, func, app, message, prefix, command)
+        )
+        self.running[task_id] = CommandTask(
+            task_id,
+            command,
+            metrics.owner(func),
+            message.chat.id,
+            task,
+        )
+
+        return message
+
+    def cancel(self, task_id: int) -> bool:
+        """Cancels the running command, returns False if there is no such one"""
+        if not (command_task := self.running.get(task_id)):
+            return False
+
+        command_task.task.cancel()
+        return True
+
+    async def _run_command(
+        self,
+        task_id: int,
+        func: FunctionType,
+        app: Client,
+        message: types.Message,
+        prefix: str,
+        command: str,
+    ) -> None:
+        """Runs the command after the previous ones of the chat, in FIFO order"""
+        if getattr(func, "_unqueued", False):
+            try:
+                return await self._execute_command(func, app, message, prefix, command)
+            finally:
+                self.running.pop(task_id, None)
+
+        chat_id = message.chat.id
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_queued[chat_id] = self._chat_queued.get(chat_id, 0) + 1
+
+        try:
+            async with lock, self._command_semaphore:
+                await self._execute_command(func, app, message, prefix, command)
+        finally:
+            self.running.pop(task_id, None)
+            self._chat_queued[chat_id] -= 1
+
+            if not self._chat_queued[chat_id]:
+                del self._chat_queued[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def _execute_command(
+        self,
+        func: FunctionType,
+        app: Client,
+        message: types.Message,
+        prefix: str,
+        command: str,
+    ) -> None:
         try:
-            await func(app, message)
-            await app.read_chat_history(message.chat.id)
+            with metrics.registry.measure("command", metrics.owner(func), command):
+                if timeout := getattr(func, "_timeout", None):
+                    await asyncio.wait_for(func(app, message), timeout)
+                else:
+                    await func(app, message)
+
+            self.read_acknowledger.mark(message.chat.id)
+
+        except Exception as error:
+            if not self.errors.count(
+                command, error, f"Command <code>{prefix}{command}</code> failed again"
+            ):
+                logging.error("Command %s failed again with %r", command, error)
+
+                with contextlib.suppress(Exception):
+                    await message.answer(
+                        f"<emoji id=5372892693024218813>🥶</emoji> <b>Command <code>{prefix}{command}</code> failed with error:</b>"
+                        f" <code>{utils.escape_html(repr(error))}</code>\n"
+                    )
+
+                return
 
-        except Exception:
             logging.exception("Error while executing command %s", command)
             item = lo.CustomException.from_exc_info(*sys.exc_info())
             exc = item.message + "\n\n" + item.full_stack
@@ -116,18 +529,60 @@ class DispatcherManager:
                 answer_message = f"<emoji id=5372892693024218813>🥶</emoji> <b>Command <code>{prefix}{command}</code> failed with error:</b>\n\n<code>{trace}</code>\n"
                 await message.answer(answer_message)
 
-        return message
-
     async def _handle_watchers(
         self, app: Client, message: types.Message
     ) -> types.Message:
         if isinstance(raw.types, raw.types.UpdatesTooLong):
             return
 
-        for watcher in self.modules.watcher_handlers:
+        before = []
+
+        for watcher in self.router.route(self.modules.watcher_handlers, message):
+            if getattr(watcher, "_before_commands", False):
+                before.append(self._run_watcher(watcher, app, message))
+                continue
+
+            task = asyncio.create_task(self._run_watcher(watcher, app, message))
+            self._watcher_tasks.add(task)
+            task.add_done_callback(self._watcher_tasks.discard)
+
+        if before:
+            await asyncio.gather(*before)
+
+        return message
+
+    async def _run_watcher(
+        self, watcher: FunctionType, app: Client, message: types.Message
+    ) -> None:
+        """Runs the watcher under the semaphore, cancelling it after the timeout"""
+        timeout = getattr(watcher, "_timeout", None) or app.db.get(
+            "shizu.dispatcher", "watcher_timeout", WATCHER_TIMEOUT
+        )
+        module = metrics.owner(watcher)
+
+        async with self._watcher_semaphore:
+            start = asyncio.get_running_loop().time()
+
             try:
-                await watcher(app, message)
+                with metrics.registry.measure("watcher", module, watcher.__name__):
+                    await asyncio.wait_for(watcher(app, message), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "Watcher %s of %s was cancelled after %ss",
+                    watcher.__name__,
+                    module,
+                    timeout,
+                )
+                return
             except Exception as error:
                 logging.exception(error)
 
-        return message
+            elapsed = asyncio.get_running_loop().time() - start
+
+            if elapsed > WATCHER_SLOW:
+                logger.warning(
+                    "Watcher %s of %s is slow, took %.2fs",
+                    watcher.__name__,
+                    module,
+                    elapsed,
+                )
@@ -50,8 +50,8 @@ from typing import Any, Dict, List, Union
 import requests
 from pyrogram import Client, filters, types
 
-from . import bot, database, dispatcher, utils, logger as logger_, extrapatchs
-from .types import InfiniteLoop
+from . import bot, database, dispatcher, sender, utils, logger as logger_, extrapatchs
+from .types import InfiniteLoop, WatcherFilter
 from .translator import Strings, Translator
 from .inter import inter
 
@@ -142,7 +142,10 @@ def get_watcher_handlers(instance: Module) -> List[FunctionType]:
         for method_name in dir(instance)
         if (
             callable(getattr(instance, method_name))
-            and method_name.startswith("watcher")
+            and (
+                method_name.startswith("watcher")
+                or hasattr(getattr(instance, method_name), "_watcher_filter")
+            )
         )
     ]
 
@@ -202,6 +205,50 @@ def on(custom_filters):
     return decorator
 
 
+def watcher(
+    chats: Union[int, List[int], None] = None,
+    outgoing: Union[bool, None] = None,
+    regex: Union[str, re.Pattern, None] = None,
+    media: Union[bool, str, List[str], None] = None,
+    edited: Union[bool, None] = None,
+    before_commands: bool = False,
+    timeout: Union[float, None] = None,
+) -> FunctionType:
+    """Declares which messages the watcher is called for
+
+    Parameters:
+        chats (`int` | `list`, optional):
+    Chat ids, any chat by default
+
+        outgoing (`bool`, optional):
+    Only outgoing if True, only incoming if False
+
+        regex (`str` | `re.Pattern`, optional):
+    Pattern searched in the text or the caption
+
+        media (`bool` | `str` | `list`, optional):
+    With or without media, or with media of these types (`"photo"`, ...)
+
+        edited (`bool`, optional):
+    Only edits if True, only new messages if False
+
+        before_commands (`bool`, optional):
+    Finish before the command of the message is run, watchers run alongside
+    commands by default
+
+        timeout (`float`, optional):
+    Seconds after which the watcher is cancelled, the dispatcher's
+    `watcher_timeout` by default"""
+
+    def decorator(func):
+        func._watcher_filter = WatcherFilter(chats, outgoing, regex, media, edited)
+        func._before_commands = before_commands
+        func._timeout = timeout
+        return func
+
+    return decorator
+
+
 def loop(
     interval: int = 5,
     autostart: typing.Optional[bool] = False,
@@ -232,18 +279,37 @@ def iter_attrs(obj: typing.Any, /) -> typing.List[typing.Tuple[str, typing.Any]]
     return ((attr, getattr(obj, attr)) for attr in dir(obj))
 
 
-def command(aliases: list = None, hidden: bool = False):
+def command(
+    aliases: list = None,
+    hidden: bool = False,
+    timeout: float = None,
+    queued: bool = True,
+    on_edit: bool = False,
+):
     def decorator(func):
         if hidden:
             func.is_hidden = True
 
+        if timeout:
+            func._timeout = timeout
+
+        if not queued:
+            # Runs at once, even if other commands of the chat are running
+            func._unqueued = True
+
+        if on_edit:
+            # Edits of the command message run the command again
+            func._rerun_on_edit = True
+
         if aliases:
-            list_ = database.db.get(__name__, "aliases", {})
 
-            for alias in aliases:
-                list_[alias] = func.__name__
+            def add_aliases(list_: dict) -> dict:
+                for alias in aliases:
+                    list_[alias] = func.__name__
+
+                return list_
 
-            database.db.set(__name__, "aliases", list_)
+            database.db.update(__name__, "aliases", add_aliases, {})
 
         func.is_command = True
         return func
@@ -365,6 +431,9 @@ class ModulesManager:
 
         extrapatchs.MessageMagic(types.Message, app)
 
+        self.sender = sender.OutboundScheduler(app)
+        self.sender.install()
+
         try:
             app.inline_bot = self.bot_manager.bot
             app.bot = self.bot_manager.bot
@@ -623,6 +692,13 @@ class ModulesManager:
             await self.send_on_load(module_name, Translator(self._app, self._db))
             self.config_reconfigure(module_name, self._db)
 
+    def reconfigure(self) -> None:
+        """Reads aliases and configs of the loaded modules from the database again"""
+        self.aliases = self._db.get(__name__, "aliases", {})
+
+        for module in self.modules:
+            self.config_reconfigure(module, self._db)
+
     @staticmethod
     def config_reconfigure(module: Module, db):
         """Reconfigures the module"""
@@ -677,11 +753,8 @@ class ModulesManager:
                     os.remove(path)
 
             if (get_module := inspect.getmodule(module)).__spec__.origin != "<string>":
-                set_modules = set(self._db.get(__name__, "modules", []))
-                self._db.set(
-                    "shizu.loader",
-                    "modules",
-                    list(set_modules - {get_module.__spec__.origin}),
+                self._db.remove_from_set(
+                    __name__, "modules", get_module.__spec__.origin
                 )
 
             for alias, command in self.aliases.copy().items():
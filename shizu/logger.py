@@ -260,6 +260,11 @@ class Telegramhandler(logging.Handler):
         self.last_log_time = None
         self.time_threshold = 1
 
+        db.subscribe("shizu.chat", "logs", self._update_chat)
+
+    def _update_chat(self, _name: str, _key: str, chat: int):
+        self.chat = chat
+
     def dumps(self, lvl: int):
         """Returns a list of all incoming logs by minimum level"""
         sorted_logs = list(
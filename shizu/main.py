@@ -17,6 +17,7 @@ import logging
 import os
 
 import sys
+import signal
 import asyncio
 import subprocess
 
@@ -25,11 +26,40 @@ from pyrogram import types
 from pyrogram.methods.utilities.idle import idle
 
 from . import auth, database, loader, utils
+from .database import replication
+
+
+async def standby(path: str):
+    """Follows the database of the primary until SIGUSR1 promotes this instance"""
+    promoted = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, promoted.set)
+
+    task = asyncio.ensure_future(replication.follow(database.db, path))
+    logging.info("Running as a standby of %s, send SIGUSR1 to promote", path)
+
+    await asyncio.wait(
+        [task, asyncio.ensure_future(promoted.wait())],
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+
+    if task.done():
+        # Following only stops on its own when it refuses to run
+        task.result()
+
+    task.cancel()
+    await database.db.flush()
+    logging.info("Promoted to primary")
 
 
 async def main():
     """Main function"""
 
+    if auth.args.standby:
+        await standby(auth.args.standby)
+
+    if auth.args.replicate:
+        await replication.ReplicationServer(database.db).start()
+
     me, app, tapp = await auth.Auth().authorize()
 
     await app.initialize()
@@ -50,7 +80,12 @@ async def main():
         id_ = (await app.get_me()).id
         db.set("shizu.me", "me", id_)
 
+    db.start_sweeper()
+
     await idle()
 
     logging.info("Shizu is shutting down...")
+    db.stop_sweeper()
+    await db.flush()
+
     return True
@@ -0,0 +1,146 @@
+# Shizu Copyright (C) 2023-2024  AmoreForever
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import math
+import time
+
+from types import FunctionType
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Buckets grow by 20% from 0.01 ms, so percentiles are off by 20% at most
+BASE = 0.01
+FACTOR = 1.2
+BUCKETS = 100
+
+
+class Histogram:
+    """Latency histogram in milliseconds with exponential buckets"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, ms: float) -> None:
+        index = 0 if ms <= BASE else int(math.log(ms / BASE, FACTOR)) + 1
+
+        self.counts[min(index, BUCKETS - 1)] += 1
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile, 0 if empty"""
+        if not self.count:
+            return 0.0
+
+        rank = math.ceil(q * self.count)
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank:
+                return min(BASE * FACTOR**index, self.max)
+
+        return self.max
+
+
+class Metric:
+    """Calls, errors and latency of one handler"""
+
+    def __init__(self, kind: str, module: str, name: str) -> None:
+        self.kind = kind
+        self.module = module
+        self.name = name
+
+        self.errors = 0
+        self.latency = Histogram()
+        self.since = time.monotonic()
+
+    @property
+    def calls(self) -> int:
+        return self.latency.count
+
+    @property
+    def per_minute(self) -> float:
+        return self.calls * 60 / max(time.monotonic() - self.since, 1)
+
+
+class Registry:
+    """Metrics of commands, watchers, inline handlers and callbacks"""
+
+    def __init__(self) -> None:
+        self.metrics: Dict[Tuple[str, str, str], Metric] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def gauge(self, name: str, func: Callable[[], float]) -> None:
+        """Registers a value that is read when the metrics are shown"""
+        self.gauges[name] = func
+
+    def get(self, kind: str, module: str, name: str) -> Metric:
+        key = (kind, module, name)
+
+        if (metric := self.metrics.get(key)) is None:
+            metric = self.metrics[key] = Metric(kind, module, name)
+
+        return metric
+
+    def observe(self, kind: str, module: str, name: str, ms: float) -> None:
+        """Records a latency measured elsewhere"""
+        self.get(kind, module, name).latency.record(ms)
+
+    @contextlib.contextmanager
+    def measure(self, kind: str, module: str, name: str) -> Iterator[Metric]:
+        """Records the time spent in the block, and an error if it raises"""
+        metric = self.get(kind, module, name)
+        start = time.perf_counter()
+
+        try:
+            yield metric
+        except Exception:
+            metric.errors += 1
+            raise
+        finally:
+            metric.latency.record((time.perf_counter() - start) * 1000)
+
+    def top(self, module: Optional[str] = None, limit: int = 10) -> List[Metric]:
+        """Metrics that took the most time in total, optionally of one module"""
+        metrics = [
+            metric
+            for metric in self.metrics.values()
+            if module is None or metric.module.lower() == module.lower()
+        ]
+        metrics.sort(key=lambda metric: metric.latency.sum, reverse=True)
+
+        return metrics[:limit]
+
+    def reset(self) -> None:
+        self.metrics.clear()
+
+
+def owner(func: FunctionType) -> str:
+    """Name of the module the handler belongs to"""
+    instance = getattr(getattr(func, "func", func), "__self__", None)
+
+    if instance is None:
+        return "unknown"
+
+    return getattr(instance, "name", None) or type(instance).__name__
+
+
+registry = Registry()
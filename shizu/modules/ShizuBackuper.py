@@ -13,19 +13,148 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
 import os
 import io
-import json
+import re
+import logging
+import zlib
+import gzip
 import time
+import hashlib
 
 from datetime import datetime
-from pyrogram import Client, types, enums
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pyrogram import Client, types
 
-from .. import loader, utils
+from .. import database, loader, utils
 
 
 LOADED_MODULES_DIR = os.path.join(os.getcwd(), "shizu/modules")
 
+STATE = "shizu.backuper"
+CHAIN_FILE = re.compile(r"^shizu-(\d{8}-\d{6})-(\d{3})\.gz$")
+
+
+def encode_backup(
+    data: Dict[str, Any],
+    hashes: Dict[str, str],
+    full: bool,
+    base: str,
+    seq: int,
+) -> Tuple[bytes, Dict[str, str], int]:
+    """Serializes and compresses the namespaces changed since `hashes`
+
+    Returns the file, the new hashes and the number of changed namespaces"""
+    codec = database.codec
+    new_hashes = {
+        name: hashlib.blake2b(codec.dumps(value), digest_size=16).hexdigest()
+        for name, value in data.items()
+    }
+
+    changed = [
+        name
+        for name, digest in new_hashes.items()
+        if full or hashes.get(name) != digest
+    ]
+    removed = [] if full else [name for name in hashes if name not in new_hashes]
+
+    backup = {
+        "base": base,
+        "seq": seq,
+        "time": time.time(),
+        "namespaces": {name: data[name] for name in changed},
+        "removed": removed,
+    }
+
+    return (
+        gzip.compress(codec.dumps(backup), 6),
+        new_hashes,
+        len(changed) + len(removed),
+    )
+
+
+def validate_backup(data: Any) -> Dict[str, Any]:
+    """Checks that the decoded backup looks like a database"""
+    if not isinstance(data, dict) or not all(
+        isinstance(name, str) and isinstance(namespace, dict)
+        for name, namespace in data.items()
+    ):
+        raise ValueError("Backup is not a database")
+
+    return data
+
+
+class UntrustedBackup(ValueError):
+    """Backup in a format that is only read when the user trusts the file"""
+
+
+def load_backup(file: bytes, trusted: bool = False) -> Any:
+    """Decodes a file written with any of the codecs
+
+    Marshal is not safe against crafted input, so it is refused unless
+    the file is `trusted`"""
+    codec = database.codecs.detect(file)
+
+    if codec.name == "marshal" and not trusted:
+        raise UntrustedBackup("Marshal backups have to be trusted explicitly")
+
+    return codec.loads(file)
+
+
+def decode_backup(file: bytes, trusted: bool = False) -> Dict[str, Any]:
+    """Decodes a plain backup written with any of the codecs"""
+    return validate_backup(load_backup(file, trusted))
+
+
+def measure_namespaces(data: Dict[str, Any]) -> Dict[str, int]:
+    """Returns the encoded size of every namespace in bytes"""
+    return {name: len(database.codec.dumps(value)) for name, value in data.items()}
+
+
+def write_archive(data: Dict[str, Any]) -> str:
+    """Saves removed namespaces next to the database, returns the file path"""
+    os.makedirs(database.ARCHIVE_LOCATION, exist_ok=True)
+    path = os.path.join(
+        database.ARCHIVE_LOCATION,
+        f"gc-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{database.codec.extension}",
+    )
+
+    with open(path, "wb") as file:
+        file.write(database.codec.dumps(data))
+
+    return path
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            break
+
+        size /= 1024
+    else:
+        unit = "GB"
+
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def rebuild_backup(chain: List[bytes], trusted: bool = False) -> Dict[str, Any]:
+    """Applies the deltas of the chain on top of its full snapshot"""
+    data = {}
+
+    for seq, file in enumerate(chain):
+        backup = load_backup(gzip.decompress(file), trusted)
+
+        if backup["seq"] != seq:
+            raise ValueError("Backup chain is out of order")
+
+        data.update(backup["namespaces"])
+
+        for name in backup["removed"]:
+            data.pop(name, None)
+
+    return validate_backup(data)
+
 
 @loader.module(name="ShizuBackuper", author="hikamoru")
 class BackupMod(loader.Module):
@@ -37,9 +166,19 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>Restoring database...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> Invalid file format",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>Backup successfully loaded</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> Restarting...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>Autobackup <u>enabled</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>Autobackup <u>disabled</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>Some backups of this chain were not found in the backups chat</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>This backup is in marshal format, which is unsafe to read from untrusted files. If you made it yourself, use</b> <code>restoredb marshal</code>",
+        "cfg_doc_interval": "Autobackup interval in hours",
+        "cfg_doc_full_every": "Take a full snapshot every N autobackups",
+        "gc_report": "🧹 <b>Database</b>: {} in {} namespaces\n\n{}",
+        "gc_orphans": "🗑 <b>Orphaned</b>: {} namespaces ({}), {} aliases",
+        "gc_dry_run": "ℹ️ <i>Dry run, nothing was changed. Use</i> <code>dbgc apply</code> <i>to archive the orphans</i>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>Orphans were archived to</b> <code>{}</code> <b>and the database was compacted</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>No orphaned data found</b>",
+        "cfg_doc_gc_interval": "Database cleanup interval in hours, 0 to disable",
+        "cfg_doc_gc_allowlist": "Namespaces that are never cleaned up",
     }
 
     strings_ru = {
@@ -48,9 +187,19 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>Восстановление базы...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> Недопустимый формат",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>Бэкап успешно загружен</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> Перезапуск...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>Автобэкап <u>включен</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>Автобэкап <u>отключен</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>Не все бэкапы этой цепочки найдены в бэкаповом чате</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>Этот бэкап в формате marshal, его небезопасно читать из чужих файлов. Если вы сделали его сами, используйте</b> <code>restoredb marshal</code>",
+        "cfg_doc_interval": "Интервал автобэкапа в часах",
+        "cfg_doc_full_every": "Делать полный снимок каждые N автобэкапов",
+        "gc_report": "🧹 <b>База</b>: {} в {} пространствах\n\n{}",
+        "gc_orphans": "🗑 <b>Без владельца</b>: {} пространств ({}), {} алиасов",
+        "gc_dry_run": "ℹ️ <i>Пробный запуск, ничего не изменено. Используйте</i> <code>dbgc apply</code><i>, чтобы архивировать их</i>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>Данные без владельца сохранены в</b> <code>{}</code><b>, база сжата</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>Данных без владельца не найдено</b>",
+        "cfg_doc_gc_interval": "Интервал очистки базы в часах, 0 чтобы отключить",
+        "cfg_doc_gc_allowlist": "Пространства, которые никогда не очищаются",
     }
 
     strings_uz = {
@@ -59,9 +208,19 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>Yozish...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> Xatolik",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>Bekap yuklandi</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> Restart...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>Autobekap <u>aktiv</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>Autobekap <u>deaktiv</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>Bu zanjirning ba'zi bekaplari backups chatda topilmadi</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>Bu bekap marshal formatida, uni begona fayllardan o'qish xavfli. Agar uni o'zingiz yaratgan bo'lsangiz,</b> <code>restoredb marshal</code> <b>dan foydalaning</b>",
+        "cfg_doc_interval": "Autobekap oralig'i (soatda)",
+        "cfg_doc_full_every": "Har N autobekapda to'liq nusxa olish",
+        "gc_report": "🧹 <b>Baza</b>: {}, {} ta bo'limda\n\n{}",
+        "gc_orphans": "🗑 <b>Egasiz</b>: {} ta bo'lim ({}), {} ta alias",
+        "gc_dry_run": "ℹ️ <i>Sinov rejimi, hech narsa o'zgarmadi. Arxivlash uchun</i> <code>dbgc apply</code>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>Egasiz ma'lumotlar</b> <code>{}</code> <b>ga arxivlandi, baza siqildi</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>Egasiz ma'lumotlar topilmadi</b>",
+        "cfg_doc_gc_interval": "Bazani tozalash oralig'i (soatda), o'chirish uchun 0",
+        "cfg_doc_gc_allowlist": "Hech qachon tozalanmaydigan bo'limlar",
     }
 
     strings_jp = {
@@ -70,9 +229,19 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>データベースの復元...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> 無効なファイル形式",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>バックアップが正常にロードされました</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> 再起動...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>自動バックアップ <u>有効</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>自動バックアップ <u>無効</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>このチェーンの一部のバックアップがバックアップチャットに見つかりません</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>このバックアップはmarshal形式で、信頼できないファイルから読み込むのは安全ではありません。ご自身で作成した場合は</b> <code>restoredb marshal</code> <b>を使用してください</b>",
+        "cfg_doc_interval": "自動バックアップの間隔（時間）",
+        "cfg_doc_full_every": "N回の自動バックアップごとに完全なスナップショットを作成",
+        "gc_report": "🧹 <b>データベース</b>: {}、{} 個の名前空間\n\n{}",
+        "gc_orphans": "🗑 <b>孤立</b>: {} 個の名前空間 ({})、{} 個のエイリアス",
+        "gc_dry_run": "ℹ️ <i>ドライランです。何も変更されていません。アーカイブするには</i> <code>dbgc apply</code>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>孤立データを</b> <code>{}</code> <b>にアーカイブし、データベースを圧縮しました</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>孤立データは見つかりませんでした</b>",
+        "cfg_doc_gc_interval": "データベースのクリーンアップ間隔（時間）、0で無効",
+        "cfg_doc_gc_allowlist": "クリーンアップされない名前空間",
     }
 
     strings_ua = {
@@ -81,9 +250,19 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>Відновлення бази...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> Неприпустимий формат",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>Бекап успішно завантажено</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> Перезапуск...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>Автобекап <u>увімкнено</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>Автобекап <u>вимкнено</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>Не всі бекапи цього ланцюжка знайдено в бекаповому чаті</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>Цей бекап у форматі marshal, його небезпечно читати з чужих файлів. Якщо ви зробили його самі, використайте</b> <code>restoredb marshal</code>",
+        "cfg_doc_interval": "Інтервал автобекапу в годинах",
+        "cfg_doc_full_every": "Робити повний знімок кожні N автобекапів",
+        "gc_report": "🧹 <b>База</b>: {} у {} просторах\n\n{}",
+        "gc_orphans": "🗑 <b>Без власника</b>: {} просторів ({}), {} аліасів",
+        "gc_dry_run": "ℹ️ <i>Пробний запуск, нічого не змінено. Використайте</i> <code>dbgc apply</code><i>, щоб архівувати їх</i>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>Дані без власника збережено в</b> <code>{}</code><b>, базу стиснуто</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>Даних без власника не знайдено</b>",
+        "cfg_doc_gc_interval": "Інтервал очищення бази в годинах, 0 щоб вимкнути",
+        "cfg_doc_gc_allowlist": "Простори, які ніколи не очищуються",
     }
 
     strings_kz = {
@@ -92,9 +271,19 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>Деректер базасын қалпына келтіру...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> Қате формат",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>Резерттеу сәтті жүктелді</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> Қайта іске қосу...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>Авторезерттеу <u>қосылған</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>Авторезерттеу <u>өшірілген</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>Бұл тізбектің кейбір резерттеулері backups chat ішінде табылмады</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>Бұл резервтік көшірме marshal форматында, оны бөгде файлдардан оқу қауіпті. Егер оны өзіңіз жасасаңыз,</b> <code>restoredb marshal</code> <b>қолданыңыз</b>",
+        "cfg_doc_interval": "Авторезерттеу аралығы (сағат)",
+        "cfg_doc_full_every": "Әр N авторезерттеу сайын толық көшірме жасау",
+        "gc_report": "🧹 <b>Деректер базасы</b>: {}, {} бөлімде\n\n{}",
+        "gc_orphans": "🗑 <b>Иесіз</b>: {} бөлім ({}), {} алиас",
+        "gc_dry_run": "ℹ️ <i>Сынақ іске қосу, ештеңе өзгертілмеді. Мұрағаттау үшін</i> <code>dbgc apply</code>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>Иесіз деректер</b> <code>{}</code> <b>ішіне мұрағатталды, база сығылды</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>Иесіз деректер табылмады</b>",
+        "cfg_doc_gc_interval": "Базаны тазалау аралығы (сағат), өшіру үшін 0",
+        "cfg_doc_gc_allowlist": "Ешқашан тазаланбайтын бөлімдер",
     }
 
     strings_kr = {
@@ -103,16 +292,235 @@ class BackupMod(loader.Module):
         "restoring": "<emoji id=5370706614800097423>🧐</emoji> <b>데이터베이스 복원...</</b>",
         "invalid": "<emoji id=5413472879771658264>❌</emoji> 잘못된 파일 형식",
         "loaded": "<emoji id=5870888735041655084>📁</emoji> <b>백업이 성공적으로 로드되었습니다</b>",
-        "restart": "<b><emoji id=5328274090262275771>🔁</emoji> 재시작...</b>",
         "enabled": "<emoji id=5260416304224936047>✅</emoji> <b>자동 백업 <u>활성화</u></b>",
         "disabled": "<emoji id=5260416304224936047>✅</emoji> <b>자동 백업 <u>비활성화</u></b>",
+        "chain_missing": "<emoji id=5413472879771658264>❌</emoji> <b>이 체인의 일부 백업을 백업 채팅에서 찾을 수 없습니다</b>",
+        "untrusted": "<emoji id=5413472879771658264>❌</emoji> <b>이 백업은 marshal 형식이며 신뢰할 수 없는 파일에서 읽는 것은 안전하지 않습니다. 직접 만든 백업이라면</b> <code>restoredb marshal</code> <b>을 사용하세요</b>",
+        "cfg_doc_interval": "자동 백업 간격(시간)",
+        "cfg_doc_full_every": "N번의 자동 백업마다 전체 스냅샷 생성",
+        "gc_report": "🧹 <b>데이터베이스</b>: {}, {}개의 네임스페이스\n\n{}",
+        "gc_orphans": "🗑 <b>고아</b>: 네임스페이스 {}개 ({}), 별칭 {}개",
+        "gc_dry_run": "ℹ️ <i>시험 실행이며 아무것도 변경되지 않았습니다. 보관하려면</i> <code>dbgc apply</code>",
+        "gc_done": "<emoji id=5260416304224936047>✅</emoji> <b>고아 데이터를</b> <code>{}</code><b>에 보관하고 데이터베이스를 압축했습니다</b>",
+        "gc_clean": "<emoji id=5260416304224936047>✅</emoji> <b>고아 데이터가 없습니다</b>",
+        "cfg_doc_gc_interval": "데이터베이스 정리 간격(시간), 0이면 비활성화",
+        "cfg_doc_gc_allowlist": "정리되지 않는 네임스페이스",
     }
 
+    def __init__(self):
+        self.config = loader.ModuleConfig(
+            "interval",
+            24,
+            lambda m: self.strings("cfg_doc_interval"),
+            "full_every",
+            7,
+            lambda m: self.strings("cfg_doc_full_every"),
+            "gc_interval",
+            0,
+            lambda m: self.strings("cfg_doc_gc_interval"),
+            "gc_allowlist",
+            [],
+            lambda m: self.strings("cfg_doc_gc_allowlist"),
+        )
+
+    @loader.loop(interval=60, wait_before=True, autostart=True)
+    async def autobackup_loop(self):
+        if not self.db.get(STATE, "enabled", False):
+            return
+
+        interval = float(self.config["interval"]) * 60 * 60
+
+        if time.time() - self.db.get(STATE, "last", 0) >= interval:
+            await self.send_autobackup()
+
+    async def run_on_copy(self, func: Callable, data: Dict[str, Any], *args) -> Any:
+        """Runs `func` in an executor with a copy of `data` taken on the loop,
+        which keeps changing the database meanwhile"""
+        return await utils.run_sync(func, database.backends.copy_data(data), *args)
+
+    async def send_autobackup(self, full: bool = False):
+        """Sends the namespaces changed since the last autobackup
+
+        Every `full_every` backups a full snapshot starts a new chain"""
+        state = self.db.get(STATE, "chain", None)
+        full = (
+            full or not state or state["seq"] + 1 >= int(self.config["full_every"])
+        )
+
+        if full:
+            base, seq, hashes = datetime.now().strftime("%Y%m%d-%H%M%S"), 0, {}
+        else:
+            base, seq, hashes = state["base"], state["seq"] + 1, state["hashes"]
+
+        self.db.load_all()
+        data = {name: value for name, value in self.db.items() if name != STATE}
+
+        file, hashes, changes = await self.run_on_copy(
+            encode_backup, data, hashes, full, base, seq
+        )
+
+        if not changes:
+            return self.db.set(STATE, "last", time.time())
+
+        document = io.BytesIO(file)
+        document.name = f"shizu-{base}-{seq:03d}.gz"
+
+        await self.app.inline_bot.send_document(
+            self.db.get("shizu.chat", "backup"),
+            document=document,
+            caption=self.strings("backup").format(
+                datetime.now().strftime("%d-%m-%Y %H:%M")
+            ),
+        )
+
+        with self.db.transaction():
+            self.db.set(STATE, "chain", {"base": base, "seq": seq, "hashes": hashes})
+            self.db.set(STATE, "last", time.time())
+
+    async def load_chain(
+        self, app: Client, base: str, seq: int
+    ) -> Optional[List[bytes]]:
+        """Downloads the full snapshot and the deltas up to `seq` of the chain"""
+        wanted = {
+            f"shizu-{base}-{number:03d}.gz": number for number in range(seq + 1)
+        }
+        found = {}
+
+        async for message in app.get_chat_history(self.db.get("shizu.chat", "backup")):
+            if (
+                message.document
+                and (number := wanted.get(message.document.file_name)) is not None
+            ):
+                found.setdefault(number, message)
+
+                if len(found) == len(wanted):
+                    break
+        else:
+            return None
+
+        return [
+            (await app.download_media(found[number], in_memory=True)).getvalue()
+            for number in range(seq + 1)
+        ]
+
+    @loader.loop(interval=60, wait_before=True, autostart=True)
+    async def gc_loop(self):
+        if not (interval := float(self.config["gc_interval"] or 0)):
+            return
+
+        if time.time() - self.db.get(STATE, "gc_last", 0) >= interval * 60 * 60:
+            found, dangling, _ = await self.find_garbage()
+
+            # Custom modules are downloaded after the start, one that is late
+            # or failed to load looks orphaned, so only what was orphaned in
+            # the previous run as well is collected
+            suspects = self.db.get(STATE, "gc_suspects", {})
+            self.db.set(STATE, "gc_suspects", {"orphans": found, "aliases": dangling})
+
+            orphans = [name for name in found if name in suspects.get("orphans", [])]
+            aliases = [name for name in dangling if name in suspects.get("aliases", [])]
+
+            if orphans or aliases:
+                path = await self.collect_garbage(orphans, aliases)
+                logging.info("Archived orphaned namespaces to %s", path)
+
+            self.db.set(STATE, "gc_last", time.time())
+
+    async def find_garbage(self) -> Tuple[List[str], List[str], Dict[str, int]]:
+        """Returns orphaned namespaces, dangling aliases and all namespace sizes
+
+        A namespace is orphaned when it is not a core one, does not belong to
+        any loaded module and is not in the `gc_allowlist` config"""
+        keep = {name.lower() for name in self.config["gc_allowlist"] or []}
+
+        for module in self.all_modules.modules:
+            keep.update((module.name.lower(), module.__class__.__name__.lower()))
+
+        self.db.load_all()
+        data = dict(self.db)
+        sizes = await self.run_on_copy(measure_namespaces, data)
+
+        orphans = [
+            name
+            for name in data
+            if not name.startswith(database.backends.CORE_PREFIX)
+            and name.lower() not in keep
+        ]
+        aliases = [
+            alias
+            for alias, command in self.all_modules.aliases.items()
+            if command not in self.all_modules.command_handlers
+        ]
+
+        return orphans, aliases, sizes
+
+    async def collect_garbage(self, orphans: List[str], aliases: List[str]) -> str:
+        """Moves orphans to an archive file, removes aliases and compacts the database
+
+        Returns the path of the archive"""
+        path = await utils.run_sync(
+            write_archive, {name: self.db[name] for name in orphans}
+        )
+
+        with self.db.transaction():
+            for name in orphans:
+                self.db.drop(name)
+
+            for alias in aliases:
+                self.all_modules.aliases.pop(alias, None)
+
+            self.db.set("shizu.loader", "aliases", self.all_modules.aliases)
+
+        await self.db.compact()
+        return path
+
+    @loader.command()
+    async def dbgc(self, app: Client, message: types.Message):
+        """Show database usage and archive orphaned data. Usage: dbgc [apply]"""
+        orphans, aliases, sizes = await self.find_garbage()
+
+        report = self.strings("gc_report").format(
+            format_size(sum(sizes.values())),
+            len(sizes),
+            "\n".join(
+                f"{'🗑' if name in orphans else '•'} <code>{utils.escape_html(name)}</code>"
+                f" — {format_size(size)}"
+                for name, size in sorted(sizes.items(), key=lambda x: -x[1])[:30]
+            ),
+        )
+
+        if not orphans and not aliases:
+            return await message.answer(f"{report}\n\n{self.strings('gc_clean')}")
+
+        report += "\n\n" + self.strings("gc_orphans").format(
+            len(orphans),
+            format_size(sum(sizes[name] for name in orphans)),
+            len(aliases),
+        )
+
+        if utils.get_args_raw(message).lower() != "apply":
+            return await message.answer(f"{report}\n\n{self.strings('gc_dry_run')}")
+
+        path = await self.collect_garbage(orphans, aliases)
+        await message.answer(f"{report}\n\n{self.strings('gc_done').format(path)}")
+
+    @loader.command()
+    async def autobackup(self, app: Client, message: types.Message):
+        """Enable or disable scheduled incremental backups"""
+        enabled = not self.db.get(STATE, "enabled", False)
+        self.db.set(STATE, "enabled", enabled)
+
+        await message.answer(self.strings("enabled" if enabled else "disabled"))
+
     @loader.command()
     async def backupdb(self, app: Client, message: types.Message):
         """Create database backup [will be sent in backups chat]"""
-        txt = io.BytesIO(json.dumps(self.db).encode("utf-8"))
-        txt.name = f"shizu-{datetime.now().strftime('%d-%m-%Y-%H-%M')}.json"
+        self.db.load_all()
+        txt = io.BytesIO(await self.run_on_copy(database.codec.dumps, dict(self.db)))
+        txt.name = (
+            f"shizu-{datetime.now().strftime('%d-%m-%Y-%H-%M')}"
+            f".{database.codec.extension}"
+        )
         await app.inline_bot.send_document(
             app.db.get("shizu.chat", "backup"),
             document=txt,
@@ -124,44 +532,54 @@ class BackupMod(loader.Module):
 
     @loader.command()
     async def restoredb(self, app: Client, message: types.Message):
-        """Easy restore database"""
+        """Easy restore database. Usage: restoredb [marshal]"""
         reply = message.reply_to_message
         if not reply or not reply.document:
             return await message.answer(self.strings("invalid"))
 
         await message.answer(self.strings("restoring"))
-        file = await app.download_media(reply.document)
-        decoded_text = json.loads(io.open(file, "r", encoding="utf-8").read())
 
-        if not file.endswith(".json"):
+        trusted = utils.get_args_raw(message).lower() == "marshal"
+
+        name = reply.document.file_name or ""
+        extensions = tuple(
+            f".{codec.extension}" for codec in database.codecs.CODECS.values()
+        )
+
+        try:
+            if chain := CHAIN_FILE.match(name):
+                base, seq = chain.group(1), int(chain.group(2))
+
+                if not (files := await self.load_chain(app, base, seq)):
+                    return await message.answer(self.strings("chain_missing"))
+
+                data = await utils.run_sync(rebuild_backup, files, trusted)
+            elif name.endswith(extensions):
+                file = await app.download_media(reply, in_memory=True)
+                data = await utils.run_sync(decode_backup, file.getvalue(), trusted)
+            else:
+                return await message.answer(self.strings("invalid"))
+        except UntrustedBackup:
+            return await message.answer(self.strings("untrusted"))
+        except (ValueError, TypeError, EOFError, KeyError, OSError, zlib.error):
             return await message.answer(self.strings("invalid"))
 
-        self.db.reset()
+        self.restore(data)
+        await self.db.flush()
 
-        self.db.update(**decoded_text)
+        await message.answer(self.strings("loaded"))
 
-        self.db.save()
+    def restore(self, data: Dict[str, Any]):
+        """Replaces the database with `data` in place, without a restart
 
-        await app.send_message(
-            message.chat.id,
-            self.strings("loaded"),
-        )
+        Subscribers are notified about the changed keys and the configs
+        of the loaded modules are read again. The state of the backuper
+        itself is kept, backups do not carry it"""
+        state = copy.deepcopy(self.db[STATE]) if STATE in self.db else {}
 
-        ms = await message.answer(self.strings("restart"))
-
-        self.db.set(
-            "shizu.updater",
-            "restart",
-            {
-                "chat": (
-                    message.chat.username
-                    if message.chat.type == enums.ChatType.BOT
-                    else message.chat.id
-                ),
-                "id": ms.id,
-                "start": time.time(),
-                "type": "restart",
-            },
-        )
+        with self.db.transaction():
+            self.db.reset()
+            self.db.update(**data)
+            self.db[STATE] = state
 
-        utils.restart()
+        self.all_modules.reconfigure()
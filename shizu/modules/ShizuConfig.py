@@ -229,14 +229,14 @@ class ShizuConfig(loader.Module):
         option: str,
         inline_message_id: str,
     ) -> None:
-        for module in self.all_modules.modules:
-            if module.name == mod:
-                with contextlib.suppress(KeyError):
-                    del self.db.setdefault(module.name, {}).setdefault(
-                        "__config__", {}
-                    )[option]
-                self.reconfmod(module, self.db)
-                self.db.save()
+        with self.db.transaction():
+            for module in self.all_modules.modules:
+                if module.name == mod:
+                    with contextlib.suppress(KeyError):
+                        del self.db.setdefault(module.name, {}).setdefault(
+                            "__config__", {}
+                        )[option]
+                    self.reconfmod(module, self.db)
 
         await call.edit(
             self.strings("restored"),
@@ -264,21 +264,21 @@ class ShizuConfig(loader.Module):
         with contextlib.suppress(ValueError, SyntaxError):
             query = ast.literal_eval(query)
 
-        for module in self.all_modules.modules:
-            if module.name == mod:
-                if query:
-                    self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                        option
-                    ] = query
-                    module.config[option] = query
-                else:
-                    with contextlib.suppress(KeyError):
-                        del self.db.setdefault(module.name, {}).setdefault(
+        with self.db.transaction():
+            for module in self.all_modules.modules:
+                if module.name == mod:
+                    if query:
+                        self.db.setdefault(module.name, {}).setdefault(
                             "__config__", {}
-                        )[option]
+                        )[option] = query
+                        module.config[option] = query
+                    else:
+                        with contextlib.suppress(KeyError):
+                            del self.db.setdefault(module.name, {}).setdefault(
+                                "__config__", {}
+                            )[option]
 
-            self.reconfmod(module, self.db)
-            self.db.save()
+                self.reconfmod(module, self.db)
 
         await call.edit(
             self.strings("option_saved").format(mod, option, query),
@@ -306,20 +306,20 @@ class ShizuConfig(loader.Module):
         with contextlib.suppress(ValueError, SyntaxError):
             query = ast.literal_eval(query)
 
-        for module in self.all_modules.modules:
-            if module.name == mod:
-                try:
-                    self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                        option
-                    ] += [query]
+        with self.db.transaction():
+            for module in self.all_modules.modules:
+                if module.name == mod:
+                    try:
+                        self.db.setdefault(module.name, {}).setdefault(
+                            "__config__", {}
+                        )[option] += [query]
 
-                except KeyError:
-                    self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                        option
-                    ] = module.config[option] + [query]
+                    except KeyError:
+                        self.db.setdefault(module.name, {}).setdefault(
+                            "__config__", {}
+                        )[option] = module.config[option] + [query]
 
-                self.reconfmod(module, self.db)
-                self.db.save()
+                    self.reconfmod(module, self.db)
 
         await call.edit(
             self.strings("option_added").format(query),
@@ -347,20 +347,20 @@ class ShizuConfig(loader.Module):
         with contextlib.suppress(ValueError, SyntaxError):
             query = ast.literal_eval(query)
 
-        for module in self.all_modules.modules:
-            if module.name == mod:
-                try:
-                    self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                        option
-                    ].remove(query)
+        with self.db.transaction():
+            for module in self.all_modules.modules:
+                if module.name == mod:
+                    try:
+                        self.db.setdefault(module.name, {}).setdefault(
+                            "__config__", {}
+                        )[option].remove(query)
 
-                except KeyError:
-                    self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                        option
-                    ] = module.config[option].remove(query)
+                    except KeyError:
+                        self.db.setdefault(module.name, {}).setdefault(
+                            "__config__", {}
+                        )[option] = module.config[option].remove(query)
 
-                self.reconfmod(module, self.db)
-                self.db.save()
+                    self.reconfmod(module, self.db)
 
         await call.edit(
             self.strings("opeion_removed").format(query),
@@ -432,14 +432,14 @@ class ShizuConfig(loader.Module):
         option: str,
         inline_message_id: str,
     ) -> None:
-        for module in self.all_modules.modules:
-            if module.name == mod:
-                self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                    option
-                ] = query
-                module.config[option] = query
-                self.reconfmod(module, self.db)
-                self.db.save()
+        with self.db.transaction():
+            for module in self.all_modules.modules:
+                if module.name == mod:
+                    self.db.setdefault(module.name, {}).setdefault(
+                        "__config__", {}
+                    )[option] = query
+                    module.config[option] = query
+                    self.reconfmod(module, self.db)
 
         await self.inline__true_false(call, mod, option)
 
@@ -540,12 +540,12 @@ class ShizuConfig(loader.Module):
                     return await call.answer("This option doesn't have a default list!")
 
                 if not self.db.get(module.name, "__config__", {}).get(config_opt):
-                    self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                        config_opt
-                    ] = module.config.getdef(config_opt)[:]
+                    with self.db.transaction():
+                        self.db.setdefault(module.name, {}).setdefault(
+                            "__config__", {}
+                        )[config_opt] = module.config.getdef(config_opt)[:]
 
-                    self.reconfmod(module, self.db)
-                    self.db.save()
+                        self.reconfmod(module, self.db)
 
                 kb = []
                 ops = [str(i) for i in module.config[config_opt]]
@@ -603,12 +603,12 @@ class ShizuConfig(loader.Module):
                 else:
                     module.config[option].append(value)
 
-                self.db.setdefault(module.name, {}).setdefault("__config__", {})[
-                    option
-                ] = module.config[option][:]
+                with self.db.transaction():
+                    self.db.setdefault(module.name, {}).setdefault(
+                        "__config__", {}
+                    )[option] = module.config[option][:]
 
-                self.reconfmod(module, self.db)
-                self.db.save()
+                    self.reconfmod(module, self.db)
 
                 await self.inline__choose(call, mod, option)
 
@@ -712,6 +712,7 @@ class ShizuConfig(loader.Module):
 
         await self.inline__global_config(message)
 
+    @loader.watcher(outgoing=True, regex=r"This message is gonna be deleted\.\.\.")
     async def watcher(self, app, message: Message) -> None:
         with contextlib.suppress(Exception):
             if (
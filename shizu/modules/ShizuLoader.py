@@ -430,11 +430,7 @@ class Loader(loader.Module):
             return await message.answer(error_text)
 
         if not is_private:
-            self.db.set(
-                "shizu.loader",
-                "modules",
-                list(set(self.db.get("shizu.loader", "modules", []) + [args])),
-            )
+            self.db.add_to_set("shizu.loader", "modules", args)
 
         if is_private:
             with open(
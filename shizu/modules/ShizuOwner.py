@@ -236,11 +236,7 @@ class ShizuOwner(loader.Module):
 
     async def add_owner_hnd(self, call: "aiogram.types.CallbackQuery", query, cid):
         user_id = (await self.app.get_users(query)).id
-        self.db.set(
-            "shizu.me",
-            "owners",
-            list(set(self.db.get("shizu.me", "owners", []) + [int(user_id)])),
-        )
+        self.db.add_to_set("shizu.me", "owners", int(user_id))
         await call.edit(
             self.strings("successfull"),
             reply_markup=[
@@ -258,11 +254,7 @@ class ShizuOwner(loader.Module):
     async def del_owner_hnd(self, call: "aiogram.types.CallbackQuery", query, cid):
         user_id = (await self.app.get_users(query)).id
 
-        self.db.set(
-            "shizu.me",
-            "owners",
-            list(set(self.db.get("shizu.me", "owners", [])) - {int(user_id)}),
-        )
+        self.db.remove_from_set("shizu.me", "owners", int(user_id))
         await call.edit(
             self.strings("successfull"),
             reply_markup=[
@@ -318,11 +310,7 @@ class ShizuOwner(loader.Module):
             await utils.answer(message, self.strings("already"))
             return
 
-        self.db.set(
-            "shizu.me",
-            "owners",
-            list(set(self.db.get("shizu.me", "owners", []) + [user_id])),
-        )
+        self.db.add_to_set("shizu.me", "owners", user_id)
 
         await utils.answer(
             message, self.strings("done").format((await app.get_users(user_id)).mention)
@@ -343,13 +331,7 @@ class ShizuOwner(loader.Module):
             await utils.answer(message, self.strings("not_owner"))
             return
 
-        self.db.set(
-            "shizu.me",
-            "owners",
-            list(set(self.db.get("shizu.me", "owners", [])) - {user_id}),
-        )
-
-        self.db.save()
+        self.db.remove_from_set("shizu.me", "owners", user_id)
 
         await utils.answer(
             message,
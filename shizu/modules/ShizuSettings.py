@@ -34,6 +34,7 @@ class ShizuSettings(loader.Module):
         "which_alias": "❔ Which alias should I add?",
         "ch_prefix": "❔ Which prefix should I change to?",
         "prefix_changed": "✅ Prefix has been changed to {}",
+        "chat_prefix_reset": "✅ Prefix of this chat has been reset, the global one is used",
         "inc_args": "❌ The arguments are incorrect.\n✅ Correct: addalias <new alias> <command>",
         "alias_already": "❌ Such an alias already exists",
         "no_command": "❌ There is no such command",
@@ -49,12 +50,20 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>Are you sure you want to stop the bot? Next time you will need to start it manually</b>",
         "shutted_down": "🩹 <b>Bot has been shutted down</b>",
         "enter_2fa": "🔐 <b>Enter your 2FA code</b>",
+        "running_tasks": "⏳ <b>Running commands:</b>\n\n{}",
+        "no_tasks": "💤 <b>No commands are running</b>",
+        "which_task": "❔ Which command should I cancel? Usage: cancel (id)",
+        "no_such_task": "❌ There is no such running command",
+        "task_cancelled": "✅ Command <code>{}</code> has been cancelled",
+        "autoread_on": "📖 This chat will be marked as read after commands again",
+        "autoread_off": "📕 This chat will no longer be marked as read after commands",
     }
 
     strings_ru = {
         "which_alias": "❔ Какой алиас добавить?",
         "ch_prefix": "❔ Какое префикс поставить?",
         "prefix_changed": "✅ Префикс изменен на {}",
+        "chat_prefix_reset": "✅ Префикс этого чата сброшен, используется общий",
         "inc_args": "❌ Параметры некорректны.\n✅ Правильно: addalias <новый алиас> <команда>",
         "alias_already": "❌ Такой алиас уже существует",
         "no_command": "❌ Такой команды не существует",
@@ -70,12 +79,20 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>Вы уверены, что хотите остановить бота? В следующий раз вам придется запустить его вручную</b>",
         "shutted_down": "🩹 <b>Бот был выключен</b>",
         "enter_2fa": "🔐 <b>Введите ваш 2FA код</b>",
+        "running_tasks": "⏳ <b>Выполняющиеся команды:</b>\n\n{}",
+        "no_tasks": "💤 <b>Никакие команды не выполняются</b>",
+        "which_task": "❔ Какую команду отменить? Использование: cancel (id)",
+        "no_such_task": "❌ Такой выполняющейся команды нет",
+        "task_cancelled": "✅ Команда <code>{}</code> отменена",
+        "autoread_on": "📖 Этот чат снова будет отмечаться прочитанным после команд",
+        "autoread_off": "📕 Этот чат больше не будет отмечаться прочитанным после команд",
     }
 
     strings_uz = {
         "which_alias": "❔ Kanday alias qo'shmoqchisiz?",
         "ch_prefix": "❔ Qaysi prefiksni o'rnatmoqchisiz?",
         "prefix_changed": "✅ Prefix {} ga ozgardi",
+        "chat_prefix_reset": "✅ Bu chat prefiksi tiklandi, umumiy prefiks ishlatiladi",
         "inc_args": "❌ Parametrlar xato.\n✅ Tog'ri: addalias <yangi alias> <komanda>",
         "alias_already": "❌ Bu alias mavjud",
         "no_command": "❌ Bu komanda mavjud emas",
@@ -91,12 +108,20 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>Siz botni to'xtatishga ishonchingiz komilmi? Keyingi safar uni ozingiz yoqishingiz kerak bo'ladi</b>",
         "shutted_down": "🩹 <b>Bot o'chirildi</b>",
         "enter_2fa": "🔐 <b>2FA kodingizni kiriting</b>",
+        "running_tasks": "⏳ <b>Bajarilayotgan buyruqlar:</b>\n\n{}",
+        "no_tasks": "💤 <b>Hech qanday buyruq bajarilmayapti</b>",
+        "which_task": "❔ Qaysi buyruqni bekor qilay? Foydalanish: cancel (id)",
+        "no_such_task": "❌ Bunday bajarilayotgan buyruq yo'q",
+        "task_cancelled": "✅ <code>{}</code> buyrug'i bekor qilindi",
+        "autoread_on": "📖 Bu chat buyruqlardan keyin yana o'qilgan deb belgilanadi",
+        "autoread_off": "📕 Bu chat endi buyruqlardan keyin o'qilgan deb belgilanmaydi",
     }
 
     strings_jp = {
         "which_alias": "❔ どのエイリアスを追加しますか？",
         "ch_prefix": "❔ どのプレフィックスを設定しますか？",
         "prefix_changed": "✅ プレフィックスが変更されました {}",
+        "chat_prefix_reset": "✅ このチャットのプレフィックスがリセットされ、共通のプレフィックスが使用されます",
         "inc_args": "❌ パラメーターが間違っています。\n✅ 正しい: addalias <新しいエイリアス> <コマンド>",
         "alias_already": "❌ このようなエイリアスは既に存在します",
         "no_command": "❌ このようなコマンドはありません",
@@ -112,12 +137,20 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>ボットを停止してもよろしいですか？ 次回は手動で起動する必要があります</b> ",
         "shutted_down": "🩹 <b>ボットがシャットダウンされました</b>",
         "enter_2fa": "🔐 <b>2FAコードを入力してください</b>",
+        "running_tasks": "⏳ <b>実行中のコマンド:</b>\n\n{}",
+        "no_tasks": "💤 <b>実行中のコマンドはありません</b>",
+        "which_task": "❔ どのコマンドをキャンセルしますか？ 使用法: cancel (id)",
+        "no_such_task": "❌ そのような実行中のコマンドはありません",
+        "task_cancelled": "✅ コマンド <code>{}</code> はキャンセルされました",
+        "autoread_on": "📖 このチャットはコマンドの後に再び既読になります",
+        "autoread_off": "📕 このチャットはコマンドの後に既読になりません",
     }
 
     strings_ua = {
         "which_alias": "❔ Який аліас додати?",
         "ch_prefix": "❔ Який префікс встановити?",
         "prefix_changed": "✅ Префікс змінено на {}",
+        "chat_prefix_reset": "✅ Префікс цього чату скинуто, використовується загальний",
         "inc_args": "❌ Параметри некоректні.\n✅ Правильно: addalias <новий аліас> <команда>",
         "alias_already": "❌ Такий аліас вже існує",
         "no_command": "❌ Такої команди не існує",
@@ -133,12 +166,20 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>Ви впевнені, що хочете зупинити бота? Наступного разу вам доведеться запустити його вручну</b>",
         "shutted_down": "🩹 <b>Бот був вимкнений</b>",
         "enter_2fa": "🔐 <b>Введіть свій 2FA код</b>",
+        "running_tasks": "⏳ <b>Команди, що виконуються:</b>\n\n{}",
+        "no_tasks": "💤 <b>Жодна команда не виконується</b>",
+        "which_task": "❔ Яку команду скасувати? Використання: cancel (id)",
+        "no_such_task": "❌ Такої команди, що виконується, немає",
+        "task_cancelled": "✅ Команду <code>{}</code> скасовано",
+        "autoread_on": "📖 Цей чат знову позначатиметься прочитаним після команд",
+        "autoread_off": "📕 Цей чат більше не позначатиметься прочитаним після команд",
     }
 
     strings_kz = {
         "which_alias": "❔ Қай алиас қосқыңыз келеді?",
         "ch_prefix": "❔ Қай префикс орнатыңыз келеді?",
         "prefix_changed": "✅ Префикс {} өзгертілді",
+        "chat_prefix_reset": "✅ Бұл чаттың префиксі қалпына келтірілді, жалпы префикс қолданылады",
         "inc_args": "❌ Параметрлер қате.\n✅ Дұрыс: addalias <жаңа алиас> <бағдарлама>",
         "alias_already": "❌ Мұндай алиас бар",
         "no_command": "❌ Мұндай бағдарлама жоқ",
@@ -154,12 +195,20 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>Ботты тоқтатуға сенімдісіз бе? Келесі рет оны қолдану үшін оны қолдану қажет болады</b>",
         "shutted_down": "🩹 <b>Бот өшірілді</b>",
         "enter_2fa": "🔐 <b>2FA кодыңызды енгізіңіз</b>",
+        "running_tasks": "⏳ <b>Орындалып жатқан командалар:</b>\n\n{}",
+        "no_tasks": "💤 <b>Ешбір команда орындалып жатқан жоқ</b>",
+        "which_task": "❔ Қай команданы болдырмау керек? Қолдану: cancel (id)",
+        "no_such_task": "❌ Мұндай орындалып жатқан команда жоқ",
+        "task_cancelled": "✅ <code>{}</code> командасы болдырылмады",
+        "autoread_on": "📖 Бұл чат командалардан кейін қайтадан оқылған деп белгіленеді",
+        "autoread_off": "📕 Бұл чат енді командалардан кейін оқылған деп белгіленбейді",
     }
 
     strings_kr = {
         "which_alias": "❔ 어떤 별칭을 추가 하시겠습니까?",
         "ch_prefix": "❔ 어떤 접두사를 설정 하시겠습니까?",
         "prefix_changed": "✅ 접두사가 변경되었습니다 {}",
+        "chat_prefix_reset": "✅ 이 채팅의 접두사가 초기화되어 공통 접두사가 사용됩니다",
         "inc_args": "❌ 매개 변수가 잘못되었습니다.\n✅ 올바른: addalias <새 별칭> <명령>",
         "alias_already": "❌ 그러한 별칭이 이미 있습니다",
         "no_command": "❌ 그러한 명령이 없습니다",
@@ -175,6 +224,13 @@ class ShizuSettings(loader.Module):
         "are_sure_to_stop": "🤔 <b>봇을 중지 하시겠습니까? 다음 번에는 수동으로 시작해야합니다</b>",
         "shutted_down": "🩹 <b>봇이 종료되었습니다</b>",
         "enter_2fa": "🔐 <b>2FA 코드를 입력하십시오</b>",
+        "running_tasks": "⏳ <b>실행 중인 명령:</b>\n\n{}",
+        "no_tasks": "💤 <b>실행 중인 명령이 없습니다</b>",
+        "which_task": "❔ 어떤 명령을 취소할까요? 사용법: cancel (id)",
+        "no_such_task": "❌ 그런 실행 중인 명령이 없습니다",
+        "task_cancelled": "✅ 명령 <code>{}</code> 이(가) 취소되었습니다",
+        "autoread_on": "📖 이 채팅은 명령 후 다시 읽음으로 표시됩니다",
+        "autoread_off": "📕 이 채팅은 더 이상 명령 후 읽음으로 표시되지 않습니다",
     }
 
     async def on_load(self, app):
@@ -215,6 +271,30 @@ class ShizuSettings(loader.Module):
         prefixes = ", ".join(f"<code>{prefix}</code>" for prefix in args)
         return await message.answer(self.strings("prefix_changed").format(prefixes))
 
+    @loader.command()
+    async def chatprefix(self, app: Client, message: types.Message):
+        """Set prefixes used only in this chat, without arguments resets them. Usage: chatprefix [prefix, ...]"""
+        args = utils.get_args_raw(message).split()
+        chat_id = str(message.chat.id)
+
+        def change(chat_prefixes: dict) -> dict:
+            chat_prefixes = dict(chat_prefixes)
+
+            if args:
+                chat_prefixes[chat_id] = list(dict.fromkeys(args))
+            else:
+                chat_prefixes.pop(chat_id, None)
+
+            return chat_prefixes
+
+        self.db.update("shizu.loader", "chat_prefixes", change, {})
+
+        if not args:
+            return await message.answer(self.strings("chat_prefix_reset"))
+
+        prefixes = ", ".join(f"<code>{prefix}</code>" for prefix in args)
+        return await message.answer(self.strings("prefix_changed").format(prefixes))
+
     @loader.command()
     async def addalias(self, app: Client, message: types.Message):
         """Add an alias. Usage: addalias (new alias) (command)"""
@@ -370,6 +450,54 @@ class ShizuSettings(loader.Module):
 
         await message.answer(self.strings["already_enabled"])
 
+    @loader.command(queued=False)
+    async def tasks(self, app: Client, message: types.Message):
+        """Show running commands"""
+        running = [
+            task
+            for task in self.all_modules.dp.running.values()
+            if not task.task.done()
+        ]
+
+        if not running:
+            return await message.answer(self.strings("no_tasks"))
+
+        return await message.answer(
+            self.strings("running_tasks").format(
+                "\n".join(
+                    f"• <code>{task.id}</code> {task.command} ({task.module})"
+                    f" in <code>{task.chat_id}</code>, {task.age:.0f}s"
+                    for task in running
+                )
+            )
+        )
+
+    @loader.command(queued=False)
+    async def cancel(self, app: Client, message: types.Message):
+        """Cancel a running command. Usage: cancel (id)"""
+        args = utils.get_args_raw(message)
+
+        if not args.isdigit():
+            return await message.answer(self.strings("which_task"))
+
+        if not self.all_modules.dp.cancel(int(args)):
+            return await message.answer(self.strings("no_such_task"))
+
+        return await message.answer(self.strings("task_cancelled").format(args))
+
+    @loader.command()
+    async def autoread(self, app: Client, message: types.Message):
+        """Toggle marking this chat as read after commands"""
+        chat_id = message.chat.id
+        disabled = chat_id in self.db.get("shizu.dispatcher", "noread_chats", [])
+
+        if disabled:
+            self.db.remove_from_set("shizu.dispatcher", "noread_chats", chat_id)
+            return await message.answer(self.strings("autoread_on"))
+
+        self.db.add_to_set("shizu.dispatcher", "noread_chats", chat_id)
+        return await message.answer(self.strings("autoread_off"))
+
     @loader.command()
     async def stopshizu(self, app, message):
         """Just turn off the bot"""
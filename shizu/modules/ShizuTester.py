@@ -41,7 +41,7 @@ import logging
 
 from pyrogram import Client, types
 
-from .. import loader, utils, logger
+from .. import loader, metrics, utils, logger
 
 
 @loader.module(name="ShizuTester", author="shizu")
@@ -54,6 +54,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "Invalid verbosity level",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu has been suspended for {} seconds</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>Invalid time to suspend</b>",
+        "stats": "📊 <b>Handlers that took the most time</b>\n⏱ Telegram delivery lag: p50 <code>{}</code> ms, p95 <code>{}</code> ms\n\n{}",
+        "no_stats": "📊 <b>Nothing has been measured yet</b>",
     }
 
     strings_ru = {
@@ -62,6 +64,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "Недопустимый уровень вывода",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu был приостановлен на {} секунд</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>Недопустимое время приостановки</b>",
+        "stats": "📊 <b>Обработчики, занявшие больше всего времени</b>\n⏱ Задержка доставки Telegram: p50 <code>{}</code> мс, p95 <code>{}</code> мс\n\n{}",
+        "no_stats": "📊 <b>Пока ничего не измерено</b>",
     }
 
     strings_uz = {
@@ -70,6 +74,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "Bunday xil xatolik yoq",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu {} soniya uchun to'xtatildi</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>To'xtatish uchun noto'g'ri vaqt</b>",
+        "stats": "📊 <b>Eng ko'p vaqt olgan ishlovchilar</b>\n⏱ Telegram yetkazish kechikishi: p50 <code>{}</code> ms, p95 <code>{}</code> ms\n\n{}",
+        "no_stats": "📊 <b>Hali hech narsa o'lchanmagan</b>",
     }
 
     strings_jp = {
@@ -78,6 +84,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "このようなエラーはありません",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu は {} 秒間停止されました</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>無効な一時停止時間</b>",
+        "stats": "📊 <b>最も時間がかかったハンドラー</b>\n⏱ Telegramの配信遅延: p50 <code>{}</code> ms, p95 <code>{}</code> ms\n\n{}",
+        "no_stats": "📊 <b>まだ何も計測されていません</b>",
     }
 
     strings_ua = {
@@ -86,6 +94,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "Недопустимий рівень виводу",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu був призупинений на {} секунд</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>Недопустимий час призупинення</b>",
+        "stats": "📊 <b>Обробники, що зайняли найбільше часу</b>\n⏱ Затримка доставки Telegram: p50 <code>{}</code> мс, p95 <code>{}</code> мс\n\n{}",
+        "no_stats": "📊 <b>Поки нічого не виміряно</b>",
     }
 
     strings_kz = {
@@ -94,6 +104,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "Бұлдай қате жоқ",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu {} секунд үшін тоқтатылды</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>Тоқтату уақыты жарамсыз</b>",
+        "stats": "📊 <b>Ең көп уақыт алған өңдеушілер</b>\n⏱ Telegram жеткізу кідірісі: p50 <code>{}</code> мс, p95 <code>{}</code> мс\n\n{}",
+        "no_stats": "📊 <b>Әзірге ештеңе өлшенбеген</b>",
     }
 
     strings_kr = {
@@ -102,6 +114,8 @@ class TesterMod(loader.Module):
         "invalid_verb": "이런 오류는 없습니다",
         "suspend": "<emoji id=5452023368054216810>🥶</emoji> <b>Shizu는 {} 초 동안 중지되었습니다</b>",
         "suspend_invalid_time": "<emoji id=5807626765874499116>🚫</emoji> <b>잘못된 일시 중지 시간</b>",
+        "stats": "📊 <b>가장 많은 시간이 걸린 핸들러</b>\n⏱ Telegram 전달 지연: p50 <code>{}</code> ms, p95 <code>{}</code> ms\n\n{}",
+        "no_stats": "📊 <b>아직 측정된 것이 없습니다</b>",
     }
 
     @loader.command()
@@ -160,3 +174,38 @@ class TesterMod(loader.Module):
 
         except ValueError:
             await message.answer(self.strings("suspend_invalid_time"))
+
+    @loader.command()
+    async def stats(self, app: Client, message: types.Message):
+        """Shows the handlers that slow the user bot down. Usage: stats [module]"""
+        module = message.get_args() or None
+        top = [
+            metric
+            for metric in metrics.registry.top(module, len(metrics.registry.metrics))
+            if metric.kind != "lag"
+        ][:15]
+
+        if not top:
+            return await message.answer(self.strings("no_stats"))
+
+        lag = metrics.registry.get("lag", "telegram", "message").latency
+
+        return await message.answer(
+            self.strings("stats").format(
+                round(lag.percentile(0.5)),
+                round(lag.percentile(0.95)),
+                "\n".join(
+                    f"• {metric.kind} <code>{metric.module}.{metric.name}</code>:"
+                    f" {metric.calls} ({metric.per_minute:.1f}/min),"
+                    f" {metric.errors} ❌, p50/p95/p99"
+                    f" <code>{metric.latency.percentile(0.5):.1f}"
+                    f"/{metric.latency.percentile(0.95):.1f}"
+                    f"/{metric.latency.percentile(0.99):.1f}</code> ms"
+                    for metric in top
+                )
+                + "".join(
+                    f"\n• {name}: <code>{func()}</code>"
+                    for name, func in metrics.registry.gauges.items()
+                ),
+            )
+        )
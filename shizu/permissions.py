@@ -0,0 +1,80 @@
+# Shizu Copyright (C) 2023-2024  AmoreForever
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import FrozenSet, Iterable, Optional
+
+from . import database
+
+WATCHED_KEYS = (
+    ("shizu.me", "me"),
+    ("shizu.me", "owners"),
+    ("shizu.owner", "status"),
+)
+
+
+class Snapshot:
+    """Identity and owner data at one point in time"""
+
+    __slots__ = ("me", "owners", "owner_mode")
+
+    def __init__(
+        self, me: Optional[int], owners: FrozenSet[int], owner_mode: bool
+    ) -> None:
+        self.me = me
+        self.owners = owners
+        self.owner_mode = owner_mode
+
+
+class Permissions:
+    """Permission checks backed by a cached snapshot of the database"""
+
+    def __init__(self, db: database.Database) -> None:
+        self._db = db
+        self._snapshot: Optional[Snapshot] = None
+
+        for name, key in WATCHED_KEYS:
+            db.subscribe(name, key, self.invalidate)
+
+    @property
+    def snapshot(self) -> Snapshot:
+        if self._snapshot is None:
+            self._snapshot = Snapshot(
+                me=self._db.get("shizu.me", "me", None),
+                owners=frozenset(self._db.get("shizu.me", "owners", [])),
+                owner_mode=bool(self._db.get("shizu.owner", "status", False)),
+            )
+
+        return self._snapshot
+
+    def invalidate(self, *_) -> None:
+        """Drops the snapshot, it will be rebuilt on the next check"""
+        self._snapshot = None
+
+    def is_owner(self, user_id: int) -> bool:
+        """Whether the user was given owner permissions"""
+        return user_id in self.snapshot.owners
+
+    def is_allowed(self, user_id: int, always_allow: Iterable[int] = ()) -> bool:
+        """Whether the user is the account itself, an owner or explicitly allowed"""
+        snapshot = self.snapshot
+
+        return (
+            user_id == snapshot.me
+            or user_id in snapshot.owners
+            or user_id in always_allow
+        )
+
+
+perms = Permissions(database.db)
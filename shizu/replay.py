@@ -0,0 +1,277 @@
+# Shizu Copyright (C) 2023-2024  AmoreForever
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Records the incoming messages and replays them through the dispatcher
+
+Recording is enabled by the `SHIZU_RECORD` environment variable, which
+names the trace file. Texts are scrubbed, only the prefix and the command
+are kept, ids of chats and users are replaced with sequential numbers.
+
+Usage:
+    python -m shizu.replay trace.jsonl [--speed X] [--watchers N] [--tracemalloc]
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from pyrogram import types
+
+from . import dispatcher, metrics, utils
+
+
+def scrub(text: Optional[str], keep: int = 0) -> Optional[str]:
+    """Replaces letters with `x` and digits with `0` after the first `keep` chars"""
+    if text is None:
+        return None
+
+    rest = re.sub(r"[^\W\d_]", "x", text[keep:])
+    return text[:keep] + re.sub(r"\d", "0", rest)
+
+
+class Recorder:
+    """Writes incoming messages to a trace file, one JSON object per line"""
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+        self._ids: Dict[int, int] = {}
+
+    def _id(self, value: Optional[int]) -> Optional[int]:
+        if value is None:
+            return None
+
+        return self._ids.setdefault(value, len(self._ids) + 1)
+
+    def write(self, message: types.Message, edited: bool = False) -> None:
+        text, caption = message.text, message.caption
+        prefix, command, args = utils.get_full_command(message)
+        keep = 0
+
+        if command:
+            # Arguments run to the end of the text, everything before them is
+            # the prefix and the command as typed, not lowercased
+            keep = len(text or caption) - len(args)
+
+        record = {
+            "date": message.date.timestamp() if message.date else time.time(),
+            "id": message.id,
+            "chat": self._id(message.chat.id if message.chat else None),
+            "user": self._id(message.from_user.id if message.from_user else None),
+            "self": bool(message.from_user and message.from_user.is_self),
+            "outgoing": bool(message.outgoing),
+            "text": scrub(text, keep if text else 0),
+            "caption": scrub(caption, keep if not text else 0),
+            "media": message.media.value if message.media else None,
+            "edited": edited,
+            "prefix": prefix or None,
+            "command": command or None,
+        }
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class StubDatabase(dict):
+    """Database that only has the defaults"""
+
+    def get(self, name: str, key: str = None, default: Any = None) -> Any:
+        return default
+
+
+class StubClient:
+    """Client whose every method does nothing"""
+
+    def __init__(self) -> None:
+        self.db = StubDatabase()
+
+    def __getattr__(self, name: str) -> Any:
+        async def method(*args, **kwargs) -> None:
+            return None
+
+        return method
+
+
+class ReplayModule:
+    """Module whose commands and watchers only yield to the loop"""
+
+    name = "Replay"
+
+    async def command(self, app: StubClient, message: Any) -> None:
+        await asyncio.sleep(0)
+
+    async def watcher(self, app: StubClient, message: Any) -> None:
+        await asyncio.sleep(0)
+
+
+def load(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def build(record: Dict[str, Any], app: StubClient) -> SimpleNamespace:
+    """Makes a message object from the record, with what the dispatcher reads"""
+
+    async def answer(*args, **kwargs) -> None:
+        return None
+
+    return SimpleNamespace(
+        id=record["id"],
+        date=datetime.fromtimestamp(record["date"]),
+        edit_date=record["date"] if record["edited"] else None,
+        chat=SimpleNamespace(id=record["chat"]),
+        from_user=SimpleNamespace(id=record["user"], is_self=record["self"]),
+        sender_chat=None,
+        outgoing=record["outgoing"],
+        text=record["text"],
+        caption=record["caption"],
+        media=SimpleNamespace(value=record["media"]) if record["media"] else None,
+        reply_to_message=None,
+        answer=answer,
+        _client=app,
+    )
+
+
+async def drain(manager: dispatcher.DispatcherManager) -> None:
+    """Waits for the commands, watchers and edits started by the replay"""
+    while True:
+        tasks = [
+            *(command.task for command in manager.running.values()),
+            *manager._watcher_tasks,
+            *manager.edits._tasks,
+        ]
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        elif manager.edits._pending:
+            await asyncio.sleep(dispatcher.EDIT_DEBOUNCE)
+        else:
+            return
+
+
+async def replay(
+    records: List[Dict[str, Any]], speed: Optional[float] = None, watchers: int = 8
+) -> Dict[str, Any]:
+    """Feeds the records to a dispatcher, at `speed` times the original pace
+    or as fast as possible if it is None"""
+    app = StubClient()
+    module = ReplayModule()
+    commands = {record["command"] for record in records if record["command"]}
+    prefixes = {record["prefix"] for record in records if record["prefix"]}
+
+    manager = dispatcher.DispatcherManager(
+        app,
+        SimpleNamespace(
+            aliases={},
+            command_handlers={command: module.command for command in commands},
+            watcher_handlers=[module.watcher for _ in range(watchers)],
+        ),
+    )
+    utils._matcher = utils.PrefixMatcher(list(prefixes) or ["."])
+    utils._chat_matchers = {}
+
+    registry = metrics.registry
+    registry.reset()
+
+    parse, route = utils.get_full_command, manager.router.route
+
+    def measured_parse(message):
+        with registry.measure("stage", "replay", "parse"):
+            return parse(message)
+
+    def measured_route(*args):
+        with registry.measure("stage", "replay", "route"):
+            return route(*args)
+
+    utils.get_full_command, manager.router.route = measured_parse, measured_route
+
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+
+    try:
+        for record in records:
+            if speed:
+                offset = (record["date"] - records[0]["date"]) / speed
+                await asyncio.sleep(max(start + offset - time.perf_counter(), 0))
+
+            handler = manager._handle_message
+
+            if record["edited"]:
+                handler = manager._handle_edited
+
+            with registry.measure("stage", "replay", "dispatch"):
+                await handler(app, build(record, app))
+
+        fed = time.perf_counter() - start
+        await drain(manager)
+    finally:
+        utils.get_full_command = parse
+
+    return {
+        "fed": fed,
+        "elapsed": time.perf_counter() - start,
+        "blocks": sys.getallocatedblocks() - blocks,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m shizu.replay")
+    parser.add_argument("trace", help="Trace file recorded with SHIZU_RECORD")
+    parser.add_argument("--speed", type=float, help="Replay at X times the pace")
+    parser.add_argument("--watchers", type=int, default=8, help="No-op watchers")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="Measure the allocated memory"
+    )
+    args = parser.parse_args()
+
+    records = load(args.trace)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    result = asyncio.run(replay(records, args.speed, args.watchers))
+
+    print(
+        f"{len(records)} updates dispatched in {result['fed']:.3f}s"
+        f" ({len(records) / max(result['fed'], 1e-9):.0f} updates/s),"
+        f" handled in {result['elapsed']:.3f}s"
+    )
+    print(f"{result['blocks'] / max(len(records), 1):.1f} blocks allocated per update")
+
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"{current / 1024:.0f} KiB held, {peak / 1024:.0f} KiB at peak")
+
+    print(f"\n{'stage':<22}{'calls':>8}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}")
+
+    for metric in metrics.registry.metrics.values():
+        if metric.kind == "lag":
+            continue
+
+        print(
+            f"{metric.kind + ' ' + metric.name:<22}{metric.calls:>8}"
+            f"{metric.latency.percentile(0.5):>10.3f}"
+            f"{metric.latency.percentile(0.95):>10.3f}"
+            f"{metric.latency.percentile(0.99):>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Shizu Copyright (C) 2023-2024  AmoreForever
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+
+from typing import Any, Callable, Dict, Hashable
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Methods of the client that send, edit or delete messages
+METHODS = [
+    "send_message",
+    "send_document",
+    "send_photo",
+    "send_animation",
+    "send_video",
+    "send_audio",
+    "send_voice",
+    "send_sticker",
+    "send_media_group",
+    "send_inline_bot_result",
+    "forward_messages",
+    "edit_message_text",
+    "edit_message_caption",
+    "edit_message_media",
+    "edit_message_reply_markup",
+    "delete_messages",
+]
+
+CHAT_RATE = 1.0
+CHAT_BURST = 5
+GLOBAL_RATE = 20.0
+GLOBAL_BURST = 30
+MAX_FLOOD_WAIT = 300
+MAX_BUCKETS = 1024
+
+# Set while a call is made, methods calling other wrapped methods do not queue twice
+_inside = contextvars.ContextVar("inside", default=False)
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average and `burst` calls at once"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Takes a token, returns how long to wait before using it"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        return max(-self.tokens / self.rate, 0)
+
+    @property
+    def full(self) -> bool:
+        elapsed = time.monotonic() - self.updated
+        return self.tokens + elapsed * self.rate >= self.burst
+
+
+class OutboundScheduler:
+    """Paces the messages the user bot sends, edits and deletes
+
+    Calls to one chat are made in order and within the chat's token bucket,
+    all of them within the global one. A FloodWait parks the queue of its
+    chat for the time Telegram asked for and retries the call, the other
+    chats keep going"""
+
+    def __init__(self, app: Client) -> None:
+        self.app = app
+        self.global_bucket = TokenBucket(
+            app.db.get("shizu.sender", "global_rate", GLOBAL_RATE),
+            app.db.get("shizu.sender", "global_burst", GLOBAL_BURST),
+        )
+
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._queued: Dict[Hashable, int] = {}
+        self._parked: Dict[Hashable, float] = {}
+
+    @property
+    def depth(self) -> int:
+        """Calls waiting for their turn or running"""
+        return sum(self._queued.values())
+
+    def install(self) -> None:
+        """Routes the sending methods of the client through the scheduler"""
+        for name in METHODS:
+            if method := getattr(self.app, name, None):
+                setattr(self.app, name, self.wrap(method))
+
+        metrics.registry.gauge("send queue, calls", lambda: self.depth)
+        metrics.registry.gauge("send queue, chats", lambda: len(self._queued))
+
+    def wrap(self, method: Callable) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs) -> Any:
+            chat_id = kwargs.get("chat_id", args[0] if args else None)
+            return await self.call(chat_id, method, *args, **kwargs)
+
+        return wrapper
+
+    async def call(self, chat_id: Hashable, method: Callable, *args, **kwargs) -> Any:
+        """Makes the call once the chat and the global limits allow it"""
+        if _inside.get():
+            return await method(*args, **kwargs)
+
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._queued[chat_id] = self._queued.get(chat_id, 0) + 1
+        queued = time.perf_counter()
+
+        try:
+            async with lock:
+                waited = (time.perf_counter() - queued) * 1000
+                metrics.registry.observe("send", "queue", method.__name__, waited)
+
+                token = _inside.set(True)
+
+                try:
+                    return await self._call(chat_id, method, *args, **kwargs)
+                finally:
+                    _inside.reset(token)
+        finally:
+            self._queued[chat_id] -= 1
+
+            if not self._queued[chat_id]:
+                del self._queued[chat_id], self._locks[chat_id]
+                self._parked.pop(chat_id, None)
+
+    async def _call(self, chat_id: Hashable, method: Callable, *args, **kwargs) -> Any:
+        bucket = self._buckets.get(chat_id)
+
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._buckets = {
+                    key: value
+                    for key, value in self._buckets.items()
+                    if not value.full
+                }
+
+            bucket = self._buckets[chat_id] = TokenBucket(
+                self.app.db.get("shizu.sender", "chat_rate", CHAT_RATE),
+                self.app.db.get("shizu.sender", "chat_burst", CHAT_BURST),
+            )
+
+        while True:
+            if (parked := self._parked.get(chat_id, 0) - time.monotonic()) > 0:
+                await asyncio.sleep(parked)
+
+            if delay := max(bucket.reserve(), self.global_bucket.reserve()):
+                await asyncio.sleep(delay)
+
+            try:
+                return await method(*args, **kwargs)
+            except FloodWait as error:
+                if int(error.value) > MAX_FLOOD_WAIT:
+                    raise
+
+                logger.warning(
+                    "FloodWait of %ss in %s, parking its queue", error.value, chat_id
+                )
+                self._parked[chat_id] = time.monotonic() + int(error.value)
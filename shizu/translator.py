@@ -23,8 +23,41 @@
 
 import os
 import json
+import functools
 
-from . import utils
+from . import database, utils
+
+_lang = None
+
+
+def _drop_lang(*_) -> None:
+    global _lang
+    _lang = None
+
+
+database.db.subscribe("shizu.me", "lang", _drop_lang)
+
+
+def get_lang() -> str:
+    """Returns the current language, cached until it is changed"""
+    global _lang
+
+    if _lang is None:
+        _lang = database.db.get("shizu.me", "lang", "en")
+
+    return _lang
+
+
+@functools.lru_cache(maxsize=None)
+def get_langpack(lang: str) -> dict:
+    """Returns the contents of the language pack, empty if there is none"""
+    langpack_path = os.path.join(utils.get_base_dir(), f"langpacks/{lang}.json")
+
+    if os.path.isfile(langpack_path):
+        with open(langpack_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return {}
 
 
 class Translator:
@@ -36,15 +69,7 @@ class Translator:
         return True
 
     def getkey(self, key):
-        lang = self.db.get("shizu.me", "lang", "en")
-        langpack_path = os.path.join(utils.get_base_dir(), f"langpacks/{lang}.json")
-
-        if os.path.isfile(langpack_path):
-            with open(langpack_path, "r", encoding="utf-8") as f:
-                lang_data = json.load(f)
-                return lang_data.get(key, False)
-
-        return False
+        return get_langpack(get_lang()).get(key, False)
 
     def gettext(self, text):
         return self.getkey(text) or text
@@ -64,7 +89,7 @@ class Strings:
         ) or (
             getattr(
                 self._mod,
-                f"strings_{self._db.get('shizu.me', 'lang', 'en')}",
+                f"strings_{get_lang()}",
                 self._base_strings,
             )
             if self._translator is not None
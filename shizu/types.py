@@ -15,9 +15,10 @@
 
 
 import asyncio
+import re
 
 from types import FunctionType
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Pattern, Union
 from logging import getLogger
 
 from pyrogram import Client, types
@@ -60,6 +61,56 @@ class ModulesManager:
         self.bot_manager
 
 
+class WatcherFilter:
+    """Conditions a message has to meet for the watcher to be called
+
+    `chats` and `outgoing` are used by the dispatcher to index watchers,
+    the rest is checked for the watchers picked from the index"""
+
+    def __init__(
+        self,
+        chats: Union[int, Iterable[int], None] = None,
+        outgoing: Optional[bool] = None,
+        regex: Union[str, Pattern, None] = None,
+        media: Union[bool, str, Iterable[str], None] = None,
+        edited: Optional[bool] = None,
+    ) -> None:
+        self.chats: Optional[FrozenSet[int]] = (
+            None
+            if chats is None
+            else frozenset([chats] if isinstance(chats, int) else chats)
+        )
+        self.outgoing = outgoing
+        self.regex: Optional[Pattern] = (
+            re.compile(regex) if isinstance(regex, str) else regex
+        )
+        self.media = (
+            frozenset([media] if isinstance(media, str) else media)
+            if media is not None and not isinstance(media, bool)
+            else media
+        )
+        self.edited = edited
+
+    def check(self, message: types.Message) -> bool:
+        """Checks the conditions that are not indexed"""
+        if self.edited is not None and bool(message.edit_date) != self.edited:
+            return False
+
+        if self.media is not None:
+            if isinstance(self.media, bool):
+                if bool(message.media) != self.media:
+                    return False
+            elif not message.media or message.media.value not in self.media:
+                return False
+
+        if self.regex is not None and not self.regex.search(
+            message.text or message.caption or ""
+        ):
+            return False
+
+        return True
+
+
 class StopLoop(Exception):
     """Stops the loop, in which is raised"""
 
@@ -28,11 +28,12 @@ import typing
 import contextlib
 import io
 import os
+import re
 import grapheme
 
 from types import FunctionType
 
-from typing import Any, List, Literal, Tuple, Union, AsyncIterator
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union, AsyncIterator
 
 from pyrogram.types import Chat, Message, User
 from pyrogram import Client, enums, types
@@ -97,6 +98,56 @@ db = database.db
 logger = logging.getLogger(__name__)
 
 
+class PrefixMatcher:
+    """Splits `<prefix><command> [args]` texts for a set of prefixes
+
+    Texts that can not start with any of the prefixes are rejected by
+    their first character, the rest by one precompiled pattern"""
+
+    def __init__(self, prefixes: List[str]) -> None:
+        self.prefixes = [prefix for prefix in prefixes or () if prefix] or ["."]
+        self._first = frozenset(prefix[0] for prefix in self.prefixes)
+        self._pattern = re.compile(
+            r"({})\s*(\S+)\s*(.*)".format(
+                "|".join(
+                    map(re.escape, sorted(self.prefixes, key=len, reverse=True))
+                )
+            ),
+            re.DOTALL,
+        )
+
+    def match(self, text: Optional[str]) -> Optional[Tuple[str, str, str]]:
+        """Returns prefix, lowercased command and arguments of a command text"""
+        if not text or text[0] not in self._first:
+            return None
+
+        if not (match := self._pattern.match(text)):
+            return None
+
+        return match[1], match[2].lower(), match[3]
+
+
+_matcher = PrefixMatcher(db.get("shizu.loader", "prefixes", ["."]))
+_chat_matchers: Dict[str, PrefixMatcher] = {}
+
+
+def _update_prefixes(_name: str, _key: str, value: List[str]) -> None:
+    global _matcher
+    _matcher = PrefixMatcher(value)
+
+
+def _update_chat_prefixes(_name: str, _key: str, value: Dict[str, List[str]]) -> None:
+    global _chat_matchers
+    _chat_matchers = {
+        chat_id: PrefixMatcher(prefixes) for chat_id, prefixes in (value or {}).items()
+    }
+
+
+_update_chat_prefixes(None, None, db.get("shizu.loader", "chat_prefixes", {}))
+db.subscribe("shizu.loader", "prefixes", _update_prefixes)
+db.subscribe("shizu.loader", "chat_prefixes", _update_chat_prefixes)
+
+
 def get_random_smartphone() -> str:
     """Returns a random smartphone model"""
 
@@ -141,21 +192,18 @@ def get_full_command(
         message (`program.types.Message`):
     Message
     """
-    message.text = str(message.text or message.caption)
-    prefixes = database.db.get("shizu.loader", "prefixes", ["."])
-
-    for prefix in prefixes:
-        if (
-            message.text
-            and len(message.text) > len(prefix)
-            and message.text.startswith(prefix)
-        ):
-            command, *args = message.text[len(prefix) :].split(maxsplit=1)
-            break
-    else:
+    matcher = _matcher
+
+    if message.chat and _chat_matchers:
+        matcher = _chat_matchers.get(str(message.chat.id), _matcher)
+
+    if not (command := matcher.match(text := message.text or message.caption)):
         return "", "", ""
 
-    return prefixes[0], command.lower(), args[-1] if args else ""
+    # Commands sent as media captions read their arguments from the text
+    message.text = text
+
+    return command
 
 
 def get_args(message: typing.Union[Message, str]) -> str:
@@ -171,6 +219,8 @@ def get_args(message: typing.Union[Message, str]) -> str:
 
 def restart():
     """Restart the bot"""
+    database.db.flush_sync()
+
     return atexit.register(os.execl(sys.executable, sys.executable, "-m", "shizu"))
 
 